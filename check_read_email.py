@@ -9,11 +9,14 @@ Description:
     This program will check for emails at regular intervals and
     if any found it will read and store the messages. When all emails
     have been saved including any attachments, it starts the script that
-    processes the saved messages.
+    processes the saved messages. The script runs in background while
+    this program continues to check for emails.
     This program is intended to be run continuously in background.
     The correct way to stop this program is by sending it a SIGINT
     signal. That way the program terminates properly. The interval
     between checks is configurable in the common configuration file.
+    If the email server supports IDLE, the server notifies this program
+    as soon as a new email arrives instead.
 
 Arguments:
     None
@@ -56,12 +59,21 @@ along with this program. If not, see <https://www.gnu.org/licenses/>.
 # Import the modules
 import os
 import sys
-from time import sleep
+import io  # Buffered reader for the compressed email server link
+import zlib  # Compression of the email server link
+from time import monotonic
 import signal
+import socket  # Socket pair to wake up a wait when a signal arrives
+import select  # To wait for IDLE responses from the email server
+import ssl  # To read ahead without waiting on an SSL link
+import shutil  # To find the process messages script
+import subprocess  # To run the process messages script in background
 import logging  # Debug and other message logging system.
 import imaplib  # IMAP library
 import email
-from email.header import decode_header
+from email.header import decode_header, make_header
+from email.parser import BytesHeaderParser
+from email.utils import parseaddr
 import re  # Regular expressions
 import dotenv   # To keep secrets in a dotenv file.
 
@@ -76,10 +88,18 @@ HTML_SUFFIX = ".html"  # HTML file name suffix
 # Set the full path for the dotenv file
 DOTENV_FILE = os.path.join(os.getcwd(), ".env")
 
+# Set the full paths for the state files with the values kept by this program
+COUNT_FILE = os.path.join(os.getcwd(), "mesg_count.state")
+MODSEQ_FILE = os.path.join(os.getcwd(), "highestmodseq.state")
+
 # Set the path names for the message and attachment folders
 MESG_FOLDER = os.getenv('MESG_FOLDER', default='messages')
 ATCH_FOLDER = os.getenv('ATCH_FOLDER', default='attachments')
 OTHR_FOLDER = os.getenv('OTHR_FOLDER', default='other_msg')
+# Full paths of these folders, ending with a slash, to prefix the filenames
+MESG_DIR = os.path.join(os.path.abspath(MESG_FOLDER), "")
+ATCH_DIR = os.path.join(os.path.abspath(ATCH_FOLDER), "")
+OTHR_DIR = os.path.join(os.path.abspath(OTHR_FOLDER), "")
 
 # Get the following constants from the main configuration file.
 # Filename for the "logging" messages file.
@@ -89,18 +109,48 @@ EMAIL_TIMEOUT = os.getenv('EMAIL_TIMEOUT', default='30')
 # Make sure the interval between email checks is an integer value.
 EMAIL_TIMEOUT = int(EMAIL_TIMEOUT)
 
+# Translation table for cleaning ASCII attachment filenames. Non-alphanumeric
+# characters, except the dot, are replaced with an underscore.
+CLEAN_TABLE = {i: (chr(i) if chr(i).isalnum() or chr(i) == "." else "_")
+               for i in range(128)}
+
+# Maximum time to wait in IDLE before it is restarted (RFC 2177: 29 minutes)
+IDLE_TIMEOUT = 1740
+
 # Script name to read and process the emails
 PROCESS_SCRIPT = './process_messages.sh'
+# Full path of the script, found once when this program is started
+PROCESS_PATH = shutil.which(PROCESS_SCRIPT) or PROCESS_SCRIPT
+
+# imaplib does not know the COMPRESS command (RFC 4978). Add it.
+imaplib.Commands.setdefault('COMPRESS', ('AUTH', 'SELECTED'))
+
+# Maximum number of messages fetched from the server with one request
+FETCH_CHUNK = 50
+
+# Parser that only parses the header of an email, used to check the sender
+HEADER_PARSER = BytesHeaderParser()
+
+# Regular expressions to get the message UID from a FETCH response and
+# the modification sequence from a SEARCH response.
+UID_REGEX = re.compile(rb'UID (\d+)')
+MODSEQ_REGEX = re.compile(rb' ?\(MODSEQ (\d+)\)')
 
 # Global variables predefined here
-#secrets = ''  # DOTENV secrets instance
+mesg_count = 1  # Message counter used in the message file names
 imap = ''  # IMAP object to access the email server
 mail_username = ''  # Email user account name
 mail_server = ''  # Email server address
 mail_portno = 993  # IMAP server port address
 mail_password = ''  # Email user account password
-mail_auth = []  # Sender authorisation email list
+mail_auth = frozenset()  # Sender authorisation email set
+auth_criteria = None  # IMAP SEARCH criteria for the authorised senders
 imap_open = False  # Flag true is connection to server is active
+condstore = False  # Flag true if the server supports CONDSTORE
+use_idle = False  # Flag true if the server supports IDLE
+process = None  # The process messages script while it is running
+last_modseq = 0  # Modification sequence of the last emails read
+debug_on = False  # Flag true if debug logging messages are logged
 
 # Get the name of this program for use in the debug logging messages.
 MYNAME = os.path.basename(sys.argv[0])
@@ -118,13 +168,33 @@ LOG_ERR = ('CKEML_0: Could not connect to IMAP server: %s',
            'CKEML_2: Failed imap search: %s',
            'CKEML_3: Failed to login: %s',
            'CKEML_4: INBOX not selected: %s',
-           'CKEML_5: Unknown sender: %s')
+           'CKEML_5: Unknown sender: %s',
+           'CKEML_6: No UID in FETCH response: %s',
+           'CKEML_7: Failed waiting for emails: %s')
 
 # LOG_INFO are the information only messages
 LOG_INFO = ('CKEML: Caught signal %s',
             'CKEML: Started pid=%s')
 
 
+# -----------------------------------------------------------------------------
+# SIGNAL WATCHER
+class SignalWatcher:
+    """
+    Keep track of the SIGINT signal.
+
+    The signal handler only records the signal number in received. The
+    main loop checks it and terminates this program properly. The signal
+    also writes a byte to the wakeup socket pair, so that any wait for
+    emails ends as soon as the signal arrives.
+    """
+
+    received = 0  # Number of the signal caught, 0 if none
+    wakeup = None  # Socket that becomes readable when a signal arrives
+    notify = None  # Socket written to by the signal system
+# End SignalWatcher
+
+
 # -----------------------------------------------------------------------------
 # SIGNAL_TERM_HANDLER
 def signal_term_handler(signalnumber, frame):
@@ -132,29 +202,44 @@ def signal_term_handler(signalnumber, frame):
     Process the SIGINT signal.
 
     This function is called when the SIGINT signal has been sent to this
-    program. It will log a INFO message to indicate that the signal was
-    received. If the IMAP connection was open, close the connection.
-    This makes it neat and tidy.
-    Terminate this program with exit code 0 as this is a normal
-    termination.
+    program. It only records that the signal was received. The main loop
+    then logs it, closes the IMAP connection and terminates this program
+    with exit code 0 as this is a normal termination.
 
     Arguments:
         signalnumber -- The number of the signal that was caught
         frame -- Info about when the signal was caught. Ignore this.
 
     Return:
-        Exit the program with code 0.
+        None
     """
 
-    logging.info(LOG_INFO[0], signalnumber)
-    # If the imap_open flag is True, close the imap connection.
-    if imap_open:
-        close_email_link()
-
-    sys.exit(0)
+    SignalWatcher.received = signalnumber
 # End signal_term_handler
 
 
+# -----------------------------------------------------------------------------
+# PAUSE
+def pause(seconds):
+    """
+    Wait for the number of seconds given or until a signal is received.
+
+    Arguments:
+        seconds -- Maximum number of seconds to wait.
+
+    Return:
+        None
+    """
+
+    if SignalWatcher.received:
+        return
+
+    ready, _, _ = select.select([SignalWatcher.wakeup], [], [], seconds)
+    if ready:
+        SignalWatcher.wakeup.recv(64)  # Empty the wakeup socket
+# End pause
+
+
 # -----------------------------------------------------------------------------
 # FUNCTION DEFINITIONS -- Common functions
 def clean(text):
@@ -164,7 +249,8 @@ def clean(text):
 
     All non alphanumeric characters in the given text are replaced with
     an underscore. It will also preserve the dot character which is
-    essential for file extensions.
+    essential for file extensions. ASCII text is translated in one pass
+    with a translation table.
 
     Arguments:
         text -- The text to be cleaned
@@ -173,16 +259,55 @@ def clean(text):
         string -- Cleaned text string.
     """
 
+    if text.isascii():
+        return text.translate(CLEAN_TABLE)
+
     return "".join(c if c.isalnum() or c == "." else "_" for c in text)
 
 
+def decode_text(text):
+    """
+    Decode the RFC 2047 encoded words in a header text.
+
+    All the encoded words are decoded and joined, so that a subject split
+    over several encoded words is complete. Text without an encoded word
+    is returned as it is, without scanning it again.
+
+    Arguments:
+        text -- The header text, e.g. a subject or a filename.
+
+    Return:
+        string -- Decoded text.
+    """
+
+    if isinstance(text, str) and "=?" not in text:
+        return text
+
+    return str(make_header(decode_header(text)))
+
+
+def decode_field(emsg, name):
+    """
+    Decode a header field of an email message.
+
+    Arguments:
+        emsg -- The email message object.
+        name -- Name of the header field, e.g. "Subject".
+
+    Return:
+        string -- Decoded text of the field, empty if there is none.
+    """
+
+    return decode_text(emsg.get(name, ""))
+
+
 def check_mail_auth(from_adrs):
     """
     Check that sender email is in the authorised list.
 
-    Check that the sender email address is in the list of authorised
-    email addresses. The checked email address is between the <..>
-    brackets in the from_adrs of the email message.
+    Check that the sender email address is in the set of authorised
+    email addresses. The email address is extracted from the from_adrs
+    of the email message and checked in lowercase.
 
     Arguments:
         from_adrs -- Text of the From line of the email message.
@@ -191,16 +316,102 @@ def check_mail_auth(from_adrs):
         True if in the list, False if not in the list.
     """
 
-    # Extract the mailbox name from the <..> part of the string
-    try:
-        regex_pattern = "<(.+?)>"
-        str_found = re.search(regex_pattern, from_adrs).group(1)
-    except AttributeError:
-        str_found = from_adrs
+    # Extract the email address from the From line
+    _, str_found = parseaddr(from_adrs)
 
-    # check that the email address found is in the list of senders ok to
+    # check that the email address found is in the set of senders ok to
     # send material. Return True or False acordingly.
-    return bool(str_found in mail_auth)
+    return str_found.lower() in mail_auth
+
+
+def read_state(filename, default):
+    """
+    Read a number from a state file.
+
+    Arguments:
+        filename -- Full path of the state file.
+        default -- Value to use if there is no valid state file.
+
+    Return:
+        integer -- The number read from the state file or the default.
+    """
+
+    try:
+        with open(filename, 'rb') as fd:
+            return int(fd.read())
+    except (OSError, ValueError):
+        return default
+
+
+def write_state(filename, value):
+    """
+    Write a number to a state file.
+
+    The number is written with a single write and flushed to the disk.
+    This is a lot cheaper than updating the dotenv file.
+
+    Arguments:
+        filename -- Full path of the state file.
+        value -- The number to write.
+
+    Return:
+        None
+    """
+
+    fd = os.open(filename, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o644)
+    try:
+        os.write(fd, b"%d\n" % value)
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+def text_payload(part, payload):
+    """
+    Convert the decoded contents of a text part to UTF-8.
+
+    The text is decoded with the character set of the part, or UTF-8 if
+    the part does not give one. Bytes that are not valid in the
+    character set are replaced.
+
+    Arguments:
+        part -- The email message part with the text.
+        payload -- The decoded contents of the part as bytes.
+
+    Return:
+        bytes -- The text encoded as UTF-8.
+    """
+
+    charset = part.get_content_charset() or "utf-8"
+    try:
+        text = payload.decode(charset, errors="replace")
+    except LookupError:  # Unknown character set
+        text = payload.decode("utf-8", errors="replace")
+    return text.encode("utf-8")
+
+
+def write_file(filepath, data):
+    """
+    Write the data to a file.
+
+    The file is written directly with os.write without a buffered file
+    object, as each file is written in one go.
+
+    Arguments:
+        filepath -- Path of the file to write.
+        data -- The bytes to write into the file.
+
+    Return:
+        None
+    """
+
+    fd = os.open(filepath, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o666)
+    try:
+        view = memoryview(data)
+        while view:
+            view = view[os.write(fd, view):]  # Write what is left
+    finally:
+        os.close(fd)
 # End Function definitions
 
 
@@ -211,10 +422,14 @@ def initialise():
     Initialise the program.
 
     Setup the variables that are also used by other functions as GLOBAL.
-    Extract from the Dotenv file the configuration variables and get the
-    DEBUG flag. Configure the logging function with the desired logging
-    level (depends on the DEBUG flag) and the message format.
-    Set the signal capture for the SIGINT signal.
+    Read the Dotenv file once. Extract from its values the configuration
+    variables and get the DEBUG flag. Read the message counter and the
+    modification sequence from their state files. If there is no message
+    counter state file yet, use the value from the Dotenv file.
+    Configure the logging function with the desired logging level
+    (depends on the DEBUG flag) and the message format.
+    Set the signal capture for the SIGINT signal and the socket pair
+    that wakes up any wait when the signal arrives.
 
     Arguments:
         None
@@ -225,6 +440,7 @@ def initialise():
 
     # Global variables for the email server, login, etc.
     global mail_username, mail_server, mail_portno, mail_password, mail_auth
+    global mesg_count, last_modseq, auth_criteria, debug_on
 
     # Get the secrets from the Dotenv file
     secrets = dotenv.dotenv_values(DOTENV_FILE)
@@ -232,13 +448,27 @@ def initialise():
     mail_server = secrets["IMAP_SERVER"]
     mail_portno = secrets["IMAP_PORT"]
     mail_password = secrets["PASSWORD"]
-    # Get the list of authorised email addresses
-    mail_auth = list(secrets["EMAIL_AUTH"].split(","))
+    # Get the set of authorised email addresses in lowercase
+    mail_auth = frozenset(adrs.strip().lower()
+                          for adrs in secrets["EMAIL_AUTH"].split(",")
+                          if adrs.strip())
+    # Build the IMAP SEARCH criteria that match any authorised sender, e.g.
+    # (OR FROM "a@b.com" FROM "c@d.com"). The search needs plain ASCII.
+    if mail_auth and all(adrs.isascii() for adrs in mail_auth):
+        quoted = [adrs.replace("\\", "\\\\").replace('"', '\\"')
+                  for adrs in sorted(mail_auth)]
+        auth_criteria = ("(" + "OR " * (len(quoted) - 1) +
+                         " ".join(f'FROM "{adrs}"' for adrs in quoted) + ")")
+    # Get the message counter for the message file names.
+    mesg_count = read_state(COUNT_FILE, int(secrets["MESG_COUNT"]))
+    # Get the modification sequence of the last emails read, if any.
+    last_modseq = read_state(MODSEQ_FILE, 0)
 
     # Set the logging level depending on the DEBUG value in th secrets file
     loglevel = getattr(logging, 'INFO', None)  # Default level is INFO
     if secrets["DEBUG"].lower() == "true":
         loglevel = getattr(logging, 'DEBUG', None)  # Set level to DEBUG
+    debug_on = loglevel == logging.DEBUG
 
     # Setup the logging facility with message format, filename and log level
     logging.basicConfig(filename=LOG_FNAME, encoding='utf-8',
@@ -247,6 +477,11 @@ def initialise():
                         level=loglevel)
 
     # Set-up the handler for the SIGINT interrupt signal.
+    SignalWatcher.wakeup, SignalWatcher.notify = socket.socketpair()
+    SignalWatcher.wakeup.setblocking(False)
+    SignalWatcher.notify.setblocking(False)
+    signal.set_wakeup_fd(SignalWatcher.notify.fileno(),
+                         warn_on_full_buffer=False)
     signal.signal(signal.SIGINT, signal_term_handler)
 
     # Send startup message with process id to the logging file
@@ -254,6 +489,108 @@ def initialise():
 # End of INITIALISE
 
 
+# -----------------------------------------------------------------------------
+# DEFLATE SOCKET
+class DeflateSocket:
+    """
+    Socket to the email server with COMPRESS=DEFLATE (RFC 4978).
+
+    Data sent to the server is compressed and data received from the
+    server is decompressed. This object replaces the socket of the IMAP
+    link. Whatever else imaplib needs is passed on to the real socket.
+    """
+
+    def __init__(self, sock):
+        self.sock = sock
+        self.compressor = zlib.compressobj(-1, zlib.DEFLATED, -15)
+        self.decompressor = zlib.decompressobj(-15)
+        self.buffer = b''  # Decompressed data not received yet
+
+    def recv(self, size):
+        """Receive up to size bytes of decompressed data."""
+        while not self.buffer:
+            data = self.sock.recv(size)
+            if not data:
+                return b''  # Connection closed
+            self.buffer = self.decompressor.decompress(data)
+        data, self.buffer = self.buffer[:size], self.buffer[size:]
+        return data
+
+    def pending(self):
+        """Return the number of bytes that can be received straight away."""
+        return len(self.buffer) or self.sock.pending()
+
+    def sendall(self, data):
+        """Compress and send all the data."""
+        self.sock.sendall(self.compressor.compress(data) +
+                          self.compressor.flush(zlib.Z_SYNC_FLUSH))
+
+    def __getattr__(self, name):
+        return getattr(self.sock, name)
+# End DeflateSocket
+
+
+class DeflateReader(io.RawIOBase):
+    """
+    Raw reader of the decompressed data from a DeflateSocket.
+
+    Used with a buffered reader to replace the file from which imaplib
+    reads the server responses. Closing it does not close the socket.
+    """
+
+    def __init__(self, sock):
+        super().__init__()
+        self.sock = sock
+
+    def readable(self):
+        return True
+
+    def readinto(self, b):
+        data = self.sock.recv(len(b))
+        b[:len(data)] = data
+        return len(data)
+# End DeflateReader
+
+
+# -----------------------------------------------------------------------------
+# START_COMPRESSION
+def start_compression():
+    """
+    Compress the data on the link to the email server.
+
+    If the server supports COMPRESS=DEFLATE, send the COMPRESS command.
+    When the server accepts it, all data sent and received from then on
+    is compressed. The headers and text of the emails compress well, so
+    a lot less data is transferred. If the server does not support it,
+    the link is used without compression.
+
+    Arguments:
+        None
+
+    Return:
+        None
+    """
+
+    if 'COMPRESS=DEFLATE' not in imap.capabilities:
+        return
+
+    try:
+        typ, dat = imap._simple_command('COMPRESS', 'DEFLATE')
+    except imaplib.IMAP4.error as err:
+        logging.debug("COMPRESS not enabled: %s", err)
+        return
+    if typ != 'OK':
+        logging.debug("COMPRESS not enabled: %s", dat)
+        return
+
+    # Replace the socket and the file that imaplib reads from.
+    imap.file.close()
+    imap.sock = DeflateSocket(imap.sock)
+    imap.file = io.BufferedReader(DeflateReader(imap.sock))
+    logging.debug("COMPRESS=DEFLATE enabled")
+# End start_compression
+
+
 # -----------------------------------------------------------------------------
 # OPEN_EMAIL_INBOX
 def open_email_inbox():
@@ -264,6 +601,10 @@ def open_email_inbox():
     the username and password from the dotenv configuration file.
     Set the variable "imap" as a global variable as it will be used in
     other functions.
+    When the server supports CONDSTORE, enable it so that the INBOX
+    modification sequence can be used to only search for new emails.
+    When the server supports IDLE, use it to wait for new emails.
+    When the server supports COMPRESS=DEFLATE, compress the link.
     If it is all successful, set the imap_open flag to True.
 
     Arguments:
@@ -274,7 +615,7 @@ def open_email_inbox():
         False -- Problem with connecting to the IMAP server.
     """
 
-    global imap, imap_open
+    global imap, imap_open, condstore, use_idle
 
     # Create an IMAP4 class with SSL
     logging.debug("Connecting to IMAP")
@@ -296,6 +637,30 @@ def open_email_inbox():
         imap_open = False
         return False
 
+    # Get the capabilities again as these can change after the login.
+    # Enable CONDSTORE if the server supports it.
+    condstore = False
+    use_idle = False
+    try:
+        typ, dat = imap.capability()
+        imap.capabilities = tuple(dat[-1].decode().upper().split())
+        use_idle = 'IDLE' in imap.capabilities
+        if 'CONDSTORE' in imap.capabilities:
+            if 'ENABLE' in imap.capabilities:
+                imap.enable('CONDSTORE')
+            condstore = True
+    except Exception as err:
+        logging.debug("CONDSTORE not enabled: %s", err)
+    logging.debug("CONDSTORE is %s, IDLE is %s", condstore, use_idle)
+
+    # Compress the link if the server supports it.
+    try:
+        start_compression()
+    except Exception as err:
+        logging.error(LOG_ERR[0], err)
+        imap_open = False
+        return False
+
     # Select the INBOX folder.
     try:
         imap.select("inbox")  # connect to inbox.
@@ -343,176 +708,282 @@ def close_email_link():
 # End close_email_link
 
 
+# -----------------------------------------------------------------------------
+# SAVE_MESSAGE
+def save_message(emsg, mcount):
+    """
+    Save an authorised email message and download any attachments.
+
+    The text/plain and text/html parts of the message are stored in the
+    "messages" folder and any attachments are stored in the
+    "attachments" folder. All filenames start with the message prefix
+    and the message counter. Filenames of attachments that have RFC 2047
+    encoded words in the name, e.g. "=?UTF-8?", are translated to proper
+    filenames.
+
+    Arguments:
+        emsg -- The email message object to save.
+        mcount -- Message counter to use in the filenames.
+
+    Return:
+        None
+    """
+
+    # Decode email sender, subject and date. Only needed for debugging.
+    if debug_on:
+        logging.debug("Subject: %s", decode_field(emsg, "Subject"))
+        logging.debug("From   : %s", decode_field(emsg, "From"))
+        logging.debug("Date   : %s", decode_field(emsg, "Date"))
+
+    # If the email message is multipart
+    if emsg.is_multipart():
+        logging.debug("Multipart detected")
+
+        # Iterate over email parts
+        for part in emsg.walk():
+            # Extract content type of email
+            content_type = part.get_content_type()
+            content_disp = str(part.get("Content-Disposition"))
+            if debug_on:
+                logging.debug("type: %s disposition %s",
+                              content_type, content_disp)
+
+            # Get the decoded part contents once. A multipart part that
+            # only holds other parts has none.
+            payload = part.get_payload(decode=True)
+            if payload is None:
+                continue
+
+            if (content_type == "text/plain" and
+               "attachment" not in content_disp):
+                # Save text/plain message
+                filepath = f"{MESG_DIR}{FILE_PREFIX}{mcount}{TEXT_SUFFIX}"
+                write_file(filepath, text_payload(part, payload))
+
+            elif (content_type == "text/html" and
+                  "attachment" not in content_disp):
+                # Save HTML message
+                filepath = f"{MESG_DIR}{FILE_PREFIX}{mcount}{HTML_SUFFIX}"
+                write_file(filepath, text_payload(part, payload))
+
+            elif "attachment" in content_disp:
+                # Download attachment
+                filename = part.get_filename()
+                if filename:
+                    # Translate any encoded words in the filename
+                    filename = decode_text(filename)
+                    logging.debug("Filename found: %s", filename)
+                    filename = f"{FILE_PREFIX}{mcount}_{clean(filename)}"
+                    filepath = ATCH_DIR + filename
+                    # Download attachment and save it
+                    write_file(filepath, payload)
+                    logging.debug("Attachment: %s downloaded", filename)
+
+    else:
+        # Extract content type of email
+        logging.debug("Not multipart")
+        content_type = emsg.get_content_type()
+        if content_type == "text/plain":
+            # Get the email body
+            payload = emsg.get_payload(decode=True)
+            filepath = f"{MESG_DIR}{FILE_PREFIX}{mcount}{TEXT_SUFFIX}"
+            write_file(filepath, text_payload(emsg, payload))
+
+    # End if emsg.is_multipart()
+# End save_message
+
+
+# -----------------------------------------------------------------------------
+# SAVE_OTHER_MESSAGE
+def save_other_message(header, from_email, mcount):
+    """
+    Save the header of an email from an unknown sender.
+
+    The header is stored in the "other_msg" folder. The rest of that
+    email is not saved.
+
+    Arguments:
+        header -- The header of the email message as bytes.
+        from_email -- Decoded From field of the email message.
+        mcount -- Message counter to use in the filename.
+
+    Return:
+        None
+    """
+
+    logging.error(LOG_ERR[5], from_email)
+    filepath = f"{OTHR_DIR}{FILE_PREFIX}{mcount}{TEXT_SUFFIX}"
+    write_file(filepath, header)
+# End save_other_message
+
+
+# -----------------------------------------------------------------------------
+# PIPELINE
+def pipeline(commands):
+    """
+    Send several commands to the email server at once.
+
+    All commands are sent before waiting for the server to complete the
+    first one. This saves waiting for the server between the commands.
+    The untagged responses of the commands are left for the caller to
+    collect.
+
+    Arguments:
+        commands -- List of tuples with a command and its arguments,
+                    e.g. ('UID', 'FETCH', '1,2', '(BODY.PEEK[])').
+
+    Return:
+        list -- The result of each command, e.g. 'OK'.
+    """
+
+    tags = [(command[0], imap._command(*command)) for command in commands]
+    return [imap._command_complete(name, tag)[0] for name, tag in tags]
+# End pipeline
+
+
+# -----------------------------------------------------------------------------
+# SEARCH_AUTHORISED
+def search_authorised(uid_set):
+    """
+    Find the emails from the authorised senders.
+
+    Ask the email server which of the emails in the UID set were sent by
+    an authorised sender. The server only checks that the From field
+    contains an authorised address, so the sender is checked again when
+    the email is read. If the server search cannot be used, all emails
+    are returned so that every sender is checked when read.
+
+    Arguments:
+        uid_set -- Comma separated list of the UIDs of the emails.
+
+    Return:
+        list -- The UIDs of the emails from the authorised senders.
+    """
+
+    if not mail_auth:
+        return []  # Nobody is authorised
+    if auth_criteria is None:
+        return uid_set.split(",")
+
+    try:
+        res, data = imap.uid('SEARCH', 'UID', uid_set, auth_criteria)
+    except imaplib.IMAP4.error as err:
+        logging.error(LOG_ERR[2], err)
+        return uid_set.split(",")
+
+    if res != 'OK':
+        logging.error(LOG_ERR[2], res)
+        return uid_set.split(",")
+
+    return data[0].decode().split() if data[0] else []
+# End search_authorised
+
+
 # -----------------------------------------------------------------------------
 # READ_EMAILS
-def read_emails(messages):
+def read_emails(uid_list):
     """
     Read the emails, store in a file and download any attachments.
 
-    Get the message count value from the DOTENV file and save the value
-    to trigger the updating of the DOTENV counter at the end of this
-    function.
-    Read each email, store its contents into a file and download any
-    attachments. Filenames of attachments that have the designation
-    "=?UTF-8?" in the name are translated to proper filenames.
-    Messages are stored in the "messages" folder and any attachments
-    are stored in the "attachments" folder.
+    Get the message count value and save the value to trigger the
+    updating of the counter state file at the end of this function.
+    The emails are read in UID order, a chunk of emails at a time. For
+    each chunk the email server is asked which emails are from an
+    authorised sender. The complete emails of those are fetched with a
+    single request and each one is saved. Of the other emails only the
+    headers are fetched with a single request and stored in the
+    "other_msg" folder. The rest of those emails is never downloaded.
+    Both requests are sent to the server at once.
+    The emails are fetched by UID and with BODY.PEEK so that the server
+    does not mark them as seen. A message without a UID in its FETCH
+    response is not read and left in the INBOX.
 
     Arguments:
-        messages - Number of messages to retrieve
+        uid_list - List of the UIDs of the messages to retrieve
 
     Return:
-        None
+        True -- All the messages were read.
+        False -- Some messages could not be read.
     """
 
+    global mesg_count
+
     remove_list = []  # Empty list of messages to remove
+    all_read = True  # Flag false if a message could not be read
 
-    # Get the message counter value from the DOTENV file and save it.
-    secrets = dotenv.dotenv_values(DOTENV_FILE)
-    mcount = int(secrets["MESG_COUNT"])
+    # Get the message counter value and save it.
+    mcount = mesg_count
     mcount_old = mcount  # Save the current message count
     logging.debug('Message count %s', mcount)
 
-    # For all messages in the INBOX, process it.
-    for i in range(1, messages + 1):
-
-        # fetch the email message by ID
-        res, msg = imap.fetch(str(i), "(RFC822)")
-        logging.debug("i=%s, res=%s, msg type=%s", i, res, type(msg))
-
-        for response in msg:
-            logging.debug("for response in msg")
-            if isinstance(response, tuple):
-                logging.debug("instance is tuple")
-                # Parse a bytes email into a message object
-                emsg = email.message_from_bytes(response[1])
-
-                # Decode email sender.
-                from_email, encoding = decode_header(emsg.get("From"))[0]
-                if isinstance(from_email, bytes):
-                    from_email = from_email.decode(encoding)
-
-                # Check if sender is authorised.
-                if not check_mail_auth(from_email):
-                    logging.error(LOG_ERR[5], from_email)
-                    filename = FILE_PREFIX + str(mcount) + TEXT_SUFFIX
-                    filepath = os.path.join(OTHR_FOLDER, filename)
-                    with open(filepath, "w", encoding="utf-8") as fd:
-                        fd.write(str(emsg))
-                    mcount += 1
-                    remove_list.append(str(i))
-                    continue
-
-                # Decode the email subject
-                subject, encoding = decode_header(emsg["Subject"])[0]
-                logging.debug("Subject type: %s Decode %s %s",
-                              type(subject), type(encoding), encoding)
-                if isinstance(subject, bytes):
-                    subject = subject.decode(encoding)
-                    logging.debug("Subject is type bytes")
-
-                # Decode email date
-                date, encoding = decode_header(emsg.get("Date"))[0]
-                if isinstance(date, bytes):
-                    date = date.decode(encoding)
-
-                logging.debug("Subject: %s", subject)
-                logging.debug("From   : %s", from_email)
-                logging.debug("Date   : %s", date)
-
-                # If the email message is multipart
-                if emsg.is_multipart():
-                    logging.debug("Multipart detected")
-
-                    # Iterate over email parts
-                    for part in emsg.walk():
-                        logging.debug("for part in emsg.walk")
-                        # Extract content type of email
-                        content_type = part.get_content_type()
-                        content_disp = str(part.get("Content-Disposition"))
-                        logging.debug("type: %s disposition %s",
-                                      content_type, content_disp)
-
-                        try:
-                            # get the email body
-                            body = part.get_payload(decode=True).decode()
-                            logging.debug("message body found")
-                        except Exception:
-                            pass  # Ignore the error.
-
-                        if (content_type == "text/plain" and
-                           "attachment" not in content_disp):
-                            # Save text/plain message
-                            filename = FILE_PREFIX + str(mcount) + TEXT_SUFFIX
-                            filepath = os.path.join(MESG_FOLDER, filename)
-                            with open(filepath, "w", encoding="utf-8") as fd:
-                                fd.write(body)
-
-                        elif (content_type == "text/html" and
-                              "attachment" not in content_disp):
-                            # Save HTML message
-                            logging.debug("Content type HTML found")
-                            filename = FILE_PREFIX + str(mcount) + HTML_SUFFIX
-                            filepath = os.path.join(MESG_FOLDER, filename)
-                            with open(filepath, "w", encoding="utf-8") as fd:
-                                fd.write(body)
-
-                        elif "attachment" in content_disp:
-                            # Download attachment
-                            logging.debug("Attachment found")
-                            filename = part.get_filename()
-                            logging.debug("filename is type: %s",
-                                          type(filename))
-                            if filename:
-                                # Check if filename needs translating (UTF-8)
-                                if "=?UTF-8" in filename:
-                                    filename, encoding = \
-                                        decode_header(filename)[0]
-                                    if isinstance(filename, bytes):
-                                        filename = filename.decode(encoding)
-                                logging.debug("Filename found: %s", filename)
-                                filename = (FILE_PREFIX + str(mcount) +
-                                            "_" + clean(filename))
-                                filepath = os.path.join(ATCH_FOLDER, filename)
-                                # Download attachment and save it
-                                with open(filepath, "wb") as f:
-                                    f.write(part.get_payload(decode=True))
-                                logging.debug("Attachment: %s downloaded",
-                                              filename)
-
-                else:
-                    # Extract content type of email
-                    logging.debug("Not multipart")
-                    content_type = emsg.get_content_type()
-                    # Get the email body
-                    body = emsg.get_payload(decode=True).decode()
-                    if content_type == "text/plain":
-                        filename = FILE_PREFIX + str(mcount) + TEXT_SUFFIX
-                        filepath = os.path.join(MESG_FOLDER, filename)
-                        with open(filepath, "w", encoding="utf-8") as fd:
-                            fd.write(body)
-
-                # End if emsg.is_multipart()
-
-            # End if isinstance(response, tuple)
-
-        remove_list.append(str(i))  # Add message id to removal list
-        mcount += 1  # Add one to the message counter
+    uid_list = sorted(uid_list, key=int)
+    for start in range(0, len(uid_list), FETCH_CHUNK):
+        chunk = uid_list[start:start + FETCH_CHUNK]
+        auth_list = search_authorised(",".join(chunk))
+        logging.debug("Authorised senders for %s", auth_list)
+
+        # Fetch the complete messages of the authorised senders and only
+        # the headers of the other messages. Both requests are sent at
+        # once so that the server can answer them without waiting.
+        othr_list = [uid for uid in chunk if uid not in auth_list]
+        commands = []
+        if len(auth_list) > 0:
+            commands.append(('UID', 'FETCH', ",".join(auth_list),
+                             "(UID BODY.PEEK[])"))
+        if len(othr_list) > 0:
+            commands.append(('UID', 'FETCH', ",".join(othr_list),
+                             "(UID BODY.PEEK[HEADER])"))
+        results = pipeline(commands)
+        res, msg = imap._untagged_response('OK', [None], 'FETCH')
+        logging.debug("res=%s, msg length=%s", results, len(msg))
+
+        # The response has a tuple for every message, each followed by its
+        # closing part. Other responses may be mixed in. Only use the
+        # tuples, each with the part that follows it.
+        for response, closing in zip(msg, msg[1:] + [None]):
+            if not isinstance(response, tuple):
+                continue
 
+            # Get the message UID. The server can send it before or after
+            # the message, so look in the closing part as well.
+            found = UID_REGEX.search(response[0])
+            if found is None and isinstance(closing, bytes):
+                found = UID_REGEX.search(closing)
+            if found is None:
+                logging.error(LOG_ERR[6], response[0])
+                all_read = False
+                continue
+            mesg_id = found.group(1).decode()
+            remove_list.append(mesg_id)  # Add UID to removal list
+
+            # Check the sender from the header only. For an authorised
+            # sender parse the complete message into a message object
+            # and save the message. Otherwise only save the header.
+            hdrs = HEADER_PARSER.parsebytes(response[1])
+            from_email = decode_field(hdrs, "From")
+            if mesg_id in auth_list and check_mail_auth(from_email):
+                save_message(email.message_from_bytes(response[1]), mcount)
+            else:
+                header = response[1].split(b"\r\n\r\n", 1)[0]
+                save_other_message(header, from_email, mcount)
+            mcount += 1  # Add one to the message counter
         # End for response in msg
-    # End for i in range
+    # End for start in range
 
-    # Delete the read emails using the message numbers in the remove_list
+    # Delete the read emails using the message UIDs in the remove_list
     if len(remove_list) > 0:  # if any messages in the list
         logging.debug("remove_list= %s", remove_list)
         delete_emails(remove_list)
 
-    # Write the message counter into the dotenv file only if changed.
+    # Write the message counter into its state file only if changed.
     if mcount_old != mcount:
         if mcount > 9990:  # Reset message counter to 1 after 9990.
             mcount = 1
-        dotenv.set_key(DOTENV_FILE, 'MESG_COUNT', str(mcount))
+        mesg_count = mcount
+        write_state(COUNT_FILE, mcount)
         logging.debug("Message counter is: %d", mcount)
+
+    return all_read
 # End read_emails()
 
 
@@ -520,12 +991,15 @@ def read_emails(messages):
 # DELETE_EMAILS
 def delete_emails(rem_list):
     """
-    Remove the emails as per the given list of email IDs
+    Remove the emails as per the given list of email UIDs
 
-    Delete the emails as per the given list of messages IDs.
+    Delete the emails as per the given list of messages UIDs. All the
+    emails are flagged as deleted with a single STORE command. If the
+    server supports UIDPLUS, only these emails are expunged with UID
+    EXPUNGE. Otherwise all deleted emails are expunged.
 
     Arguments:
-        rem_list -- List of email IDs to delete from the email inbox
+        rem_list -- List of email UIDs to delete from the email inbox
 
     return:
         None
@@ -533,17 +1007,338 @@ def delete_emails(rem_list):
 
     logging.debug("Deleting emails")
 
-    for mail_id in rem_list:
-        resp_code, response = imap.store(mail_id, "+FLAGS", "\\Deleted")
-        logging.debug("Delete code %s Resp %s", resp_code,
-                      response[0].decode() if response[0] else None)
-
-    resp_code, response = imap.expunge()
-    logging.debug("Expunge code %s Resp %s", resp_code,
-                  response[0].decode() if response[0] else None)
+    # Send the STORE and EXPUNGE commands at once.
+    uid_set = ",".join(rem_list)
+    commands = [('UID', 'STORE', uid_set, "+FLAGS", "(\\Deleted)")]
+    if 'UIDPLUS' in imap.capabilities:
+        commands.append(('UID', 'EXPUNGE', uid_set))
+    else:
+        commands.append(('EXPUNGE',))
+    results = pipeline(commands)
+    logging.debug("Delete and expunge codes %s", results)
+
+    # Drop the responses to these commands.
+    imap.untagged_responses.pop('FETCH', None)
+    imap.untagged_responses.pop('EXPUNGE', None)
 # End delete_emails
 
 
+# -----------------------------------------------------------------------------
+# SEARCH_INBOX
+def search_inbox():
+    """
+    Search the INBOX for the emails that are to be read.
+
+    When the email server supports CONDSTORE, the HIGHESTMODSEQ of the
+    INBOX given by the last SELECT is compared with the modification
+    sequence of the last emails read. If these are the same, nothing
+    has changed and there is no need to search. If it is higher, only
+    the messages changed since the last emails read are searched for.
+    Without CONDSTORE, or when the INBOX gives no HIGHESTMODSEQ (e.g.
+    NOMODSEQ), all the messages in the INBOX are searched for.
+    The messages are identified by their UID as these do not change
+    when other messages are expunged.
+
+    Arguments:
+        None
+
+    Return:
+        uid_list, modseq -- List of UIDs of the messages found and the
+                            modification sequence to save when read.
+        None -- The search failed.
+    """
+
+    criteria = ('ALL',)  # Search for all messages by default
+    highest = None  # HIGHESTMODSEQ of the INBOX
+
+    if condstore:
+        typ, dat = imap.response('HIGHESTMODSEQ')
+        if dat[0] is not None:
+            highest = int(dat[0])
+        if highest == last_modseq:
+            return [], last_modseq  # Nothing changed since last check
+        if highest is not None and highest > last_modseq:
+            # Only search for messages changed since the last check.
+            criteria = ('MODSEQ', str(last_modseq + 1))
+
+    # Check for any email messages
+    try:
+        return_code, mail_ids = imap.uid('SEARCH', *criteria)
+    except Exception as err:
+        logging.error(LOG_ERR[2], err)
+        return None
+
+    if return_code != 'OK':
+        return None
+
+    logging.debug("Return Code %s, Mail ID %s", return_code, mail_ids[0])
+
+    # Split the UIDs from the modification sequence, if this was given.
+    found = MODSEQ_REGEX.search(mail_ids[0])
+    uid_list = MODSEQ_REGEX.sub(b'', mail_ids[0]).decode().split()
+    if found:
+        modseq = int(found.group(1))
+    elif highest is not None:
+        modseq = highest
+    else:
+        modseq = last_modseq
+
+    return uid_list, modseq
+# End search_inbox
+
+
+# -----------------------------------------------------------------------------
+# UPDATE_MODSEQ
+def update_modseq(modseq):
+    """
+    Save the modification sequence of the last emails read.
+
+    If CONDSTORE is used and the value has changed, keep the new value
+    and write it into its state file so that it is used again when
+    this program is restarted.
+
+    Arguments:
+        modseq -- The modification sequence to save.
+
+    Return:
+        None
+    """
+
+    global last_modseq
+
+    if condstore and modseq != last_modseq:
+        last_modseq = modseq
+        write_state(MODSEQ_FILE, modseq)
+        logging.debug("Modification sequence is: %d", modseq)
+# End update_modseq
+
+
+# -----------------------------------------------------------------------------
+# RECEIVE_LINES
+def receive_lines(buffer, timeout):
+    """
+    Receive response lines directly from the email server socket.
+
+    If the buffer already holds complete lines, these are returned
+    first. Otherwise wait for data from the server for at most the
+    timeout given. Data already received by the SSL layer is used
+    straight away. The data is added to the buffer and split into
+    complete lines. The wait also ends when a signal is received.
+
+    Arguments:
+        buffer -- Data received earlier that is not a complete line.
+        timeout -- Maximum number of seconds to wait for data.
+
+    Return:
+        lines, buffer -- List of complete lines received and the data
+                         left over that is not a complete line yet.
+        None -- Nothing received before the timeout or the signal.
+    """
+
+    # Use the complete lines left in the buffer first.
+    if b'\r\n' in buffer:
+        lines = buffer.split(b'\r\n')
+        buffer = lines.pop()  # Last item is not a complete line
+        return lines, buffer
+
+    if not imap.sock.pending():
+        ready, _, _ = select.select([imap.sock, SignalWatcher.wakeup], [],
+                                    [], timeout)
+        if SignalWatcher.wakeup in ready:
+            SignalWatcher.wakeup.recv(64)  # Empty the wakeup socket
+        if imap.sock not in ready:
+            return None
+
+    data = imap.sock.recv(4096)
+    if not data:
+        raise imaplib.IMAP4.abort("Connection closed by the server")
+
+    lines = (buffer + data).split(b'\r\n')
+    buffer = lines.pop()  # Last item is not a complete line
+    return lines, buffer
+# End receive_lines
+
+
+# -----------------------------------------------------------------------------
+# READ_AHEAD
+def read_ahead():
+    """
+    Take the data imaplib has read from the server but not used yet.
+
+    imaplib reads the server responses through a buffered file. This can
+    hold responses, e.g. an EXISTS, that the server sent straight after
+    the last command completed. These are not seen by a select() on the
+    socket. The buffer is read without waiting for the server.
+
+    Arguments:
+        None
+
+    Return:
+        bytes -- The data read ahead, empty if there is none.
+    """
+
+    timeout = imap.sock.gettimeout()
+    imap.sock.settimeout(0)  # Do not wait for more data from the server
+    try:
+        data = imap.file.peek()
+    except (BlockingIOError, ssl.SSLWantReadError):
+        data = b''
+    finally:
+        imap.sock.settimeout(timeout)
+
+    if data:
+        data = imap.file.read1(len(data))
+    return data
+# End read_ahead
+
+
+# -----------------------------------------------------------------------------
+# WAIT_FOR_EMAIL
+def wait_for_email(idle=True):
+    """
+    Wait for new emails to arrive.
+
+    If the email server supports IDLE and the idle argument is True,
+    send the IDLE command. The server will then send an EXISTS response
+    as soon as a new email arrives.
+    When it does, or after the IDLE timeout of 29 minutes, end the IDLE
+    command with DONE and wait for the server to complete it. A SIGINT
+    signal also ends the IDLE command straight away.
+    If the server does not support IDLE or refuses the IDLE command,
+    sleep for the configured number of seconds instead.
+
+    Arguments:
+        idle -- False to sleep even if IDLE is supported. Used when
+                emails are waiting in the INBOX to be read.
+
+    Return:
+        None
+    """
+
+    global use_idle
+
+    if not (use_idle and idle):
+        pause(EMAIL_TIMEOUT)
+        return
+
+    # An email that arrived while reading the INBOX has been reported
+    # already. Do not wait for it.
+    if imap.untagged_responses.pop('EXISTS', None):
+        return
+
+    # The responses imaplib has read ahead may report one as well.
+    buffer = read_ahead()  # Data received that is not processed yet
+    if b' EXISTS\r\n' in buffer:
+        logging.debug("New email reported before IDLE")
+        return
+
+    tag = imap._new_tag()
+    imap.send(tag + b' IDLE\r\n')
+    logging.debug("IDLE started")
+
+    new_email = False
+    end_time = monotonic() + IDLE_TIMEOUT
+
+    while (not new_email and not SignalWatcher.received
+           and monotonic() < end_time):
+        received = receive_lines(buffer, end_time - monotonic())
+        if received is None:
+            continue  # IDLE timed out or signal received
+
+        lines, buffer = received
+        for line in lines:
+            logging.debug("IDLE response: %s", line)
+            if line.startswith(tag):
+                # IDLE refused by the server. Do not use it again.
+                imap.tagged_commands.pop(tag, None)
+                use_idle = False
+                pause(EMAIL_TIMEOUT)
+                return
+            if line.endswith(b' EXISTS'):
+                new_email = True
+
+    # End the IDLE command and wait for the server to complete it. Also
+    # read the rest of a response that is only partly received, so that
+    # imaplib does not start reading in the middle of it.
+    imap.send(b'DONE\r\n')
+    completed = False
+    while not completed or buffer:
+        received = receive_lines(buffer, EMAIL_TIMEOUT)
+        if received is None:
+            raise imaplib.IMAP4.abort("IDLE not completed by the server")
+        lines, buffer = received
+        for line in lines:
+            if completed:
+                # Not used. The next SELECT gets the INBOX state again.
+                logging.debug("Response after IDLE ignored: %s", line)
+            elif line.startswith(tag):
+                completed = True
+
+    imap.tagged_commands.pop(tag, None)
+    logging.debug("IDLE ended, new email is %s", new_email)
+# End wait_for_email
+
+
+# -----------------------------------------------------------------------------
+# START_PROCESS_SCRIPT
+def start_process_script():
+    """
+    Start the script that processes the saved messages.
+
+    The script is started in background in its own session so that this
+    program can continue checking for emails while it runs.
+
+    Arguments:
+        None
+
+    Return:
+        None
+    """
+
+    global process
+
+    try:
+        process = subprocess.Popen([PROCESS_PATH], close_fds=True,
+                                   start_new_session=True)
+    except OSError as err:
+        logging.error(LOG_ERR[1], err)
+        process = None
+# End start_process_script
+
+
+# -----------------------------------------------------------------------------
+# CHECK_PROCESS_SCRIPT
+def check_process_script():
+    """
+    Check if the script that processes the saved messages is running.
+
+    If the script has finished, log an error if its exit status shows
+    that it failed.
+
+    Arguments:
+        None
+
+    Return:
+        True -- The script is still running.
+        False -- The script is not running.
+    """
+
+    global process
+
+    if process is None:
+        return False
+
+    outcome = process.poll()
+    if outcome is None:
+        return True  # Still running
+
+    if outcome != 0:
+        logging.error(LOG_ERR[1], outcome)
+    process = None
+    return False
+# End check_process_script
+
+
 # -----------------------------------------------------------------------------
 # MAIN
 def main():
@@ -562,9 +1357,14 @@ def main():
     'sentry' flag is true. Therefore this flag controls the loop.
     This inner loop is the one that will check if there are any INBOX
     email messages. If messages found, read and save the messages and
-    any attachments. Then process the email messages.
-    At the end of this -inner- loop, wait for a "configurable" number
-    of seconds before continuing the loop.
+    any attachments. Then start the script to process the email messages
+    in background. While the script is still running, any new emails
+    are left in the INBOX until it has finished.
+    At the end of this -inner- loop, wait for new emails to arrive.
+    This is either done with IDLE or by waiting for a "configurable"
+    number of seconds before continuing the loop.
+    Both loops end when the SIGINT signal has been received. Then log
+    the signal, close the IMAP connection and exit with code 0.
 
     Arguments:
         None
@@ -577,9 +1377,9 @@ def main():
 
     initialise()  # Set-up the program and the constants.
 
-    # This is the outer loop of this program. It runs forever.
-    # This program is terminated by sending the SIGINT signal.
-    while True:
+    # This is the outer loop of this program. It runs until this program
+    # is terminated by sending the SIGINT signal.
+    while not SignalWatcher.received:
         sentry = True  # Allows the inner loop to work.
 
         # Open the connection to the email server and log on.
@@ -589,12 +1389,16 @@ def main():
 
         # This is the inner loop that will check for any emails in the INBOX.
         # Its loop is stopped by the 'sentry' flag being False.
-        while sentry:
-            count = 0  # Set message counter to zero
+        while sentry and not SignalWatcher.received:
+            # Check if the messages are still being processed.
+            processing = check_process_script()
 
             # Select the INBOX folder.
             try:
                 imap.select()  # connect to inbox.
+                # The EXISTS of the SELECT is not a new email. Only an
+                # EXISTS received after the search ends the wait early.
+                imap.untagged_responses.pop('EXISTS', None)
             except Exception as err:
                 logging.error(LOG_ERR[4], err)
                 imap_open = close_email_link()
@@ -602,47 +1406,60 @@ def main():
                 continue
 
             # Check for any email messages
-            try:
-                return_code, mail_ids = imap.search(None, 'ALL')
-            except Exception as err:
-                logging.error(LOG_ERR[2], err)
-                return_code = None
-
-            if return_code == 'OK':
-                # Get the number of new email messages
-                logging.debug("Return Code %s, Mail ID %s, length %s",
-                              return_code, mail_ids[0], len(mail_ids[0]))
-                count = len((mail_ids[0].decode()).split(" ")) \
-                    if len(mail_ids[0]) > 0 else 0
-            else:
+            found = search_inbox()
+            if found is None:
                 # Email check failed. Close cnx and wait the time out
                 imap_open = close_email_link()  # Close the IMAP link
                 sentry = False  # Stop this inner loop, forces reconnect
+                found = ([], last_modseq)
+
+            uid_list, modseq = found
+            all_read = True  # Flag false if an email could not be read
+
+            # If the earlier messages are still being processed, leave
+            # any emails in the INBOX until the next check.
+            waiting = len(uid_list) > 0 and processing
+            if waiting:
+                logging.debug("Messages still being processed")
 
             # If there are any emails waiting, read and save them.
-            # When read and saved, run the script to process them.
-            if count > 0:
+            # When read and saved, start the script to process them.
+            elif len(uid_list) > 0:
                 # There are unread emails. First close the email link
                 #imap_open = close_email_link()  # Close the IMAP link
-                logging.debug("There are %d INBOX messages", count)
+                logging.debug("There are %d INBOX messages", len(uid_list))
 
                 # Read and save the email in the INBOX
-                read_emails(count)
-
-                # Start the script to reead and process the emails
-                outcome = os.system(PROCESS_SCRIPT)
-                if outcome != 0:
-                    logging.error(LOG_ERR[1], outcome)
-
-            # Sleep for a number of seconds before checking again
-            sleep(EMAIL_TIMEOUT)
+                all_read = read_emails(uid_list)
+
+                # Start the script to read and process the emails
+                start_process_script()
+
+            # Keep the modification sequence of the emails read. If an
+            # email could not be read, keep the old one so that the next
+            # search finds that email again.
+            if not waiting and all_read:
+                update_modseq(modseq)
+
+            # Wait for new emails before checking again
+            if sentry:
+                try:
+                    wait_for_email(idle=not waiting)
+                except Exception as err:
+                    logging.error(LOG_ERR[7], err)
+                    imap_open = close_email_link()  # Close the IMAP link
+                    sentry = False  # Stop this inner loop, forces reconnect
         # End while sentry
 
-        sleep(EMAIL_TIMEOUT)
-    # End while True
+        pause(EMAIL_TIMEOUT)
+    # End while not SignalWatcher.received
 
-    # Unlikely to finish here, but keep just in case.
-    imap_open = close_email_link()  # Close the IMAP link
+    logging.info(LOG_INFO[0], SignalWatcher.received)
+    # If the imap_open flag is True, close the imap connection.
+    if imap_open:
+        imap_open = close_email_link()  # Close the IMAP link
+
+    sys.exit(0)
 # End of main
 
 
@@ -28,7 +28,7 @@ Run info:
 See also:
     dotenv -- dotenv file for configuration information.
     process_messages.sh -- Script that executes this program.
-    html2text -- Utility to convert HTML to text.
+    html2text -- Python module or utility to convert HTML to text.
     signage.conf -- Configuration data providing environment variables
                     when running this inside a BASH script.
 
@@ -55,16 +55,24 @@ along with this program. If not, see <https://www.gnu.org/licenses/>.
 
 # -----------------------------------------------------------------------------
 # MODULES
-import glob
 import os
 import sys
-import csv
-import re
+import shlex
+import string
 import subprocess  # For running the html2text utility
 import shutil  # Used for copying running files
 import logging  # Debug and other message logging system
 import dotenv  # Secrets and other configuration data
 import platform   # To detect which html2text command to run
+from contextlib import suppress  # Ignore files that are already removed
+from concurrent.futures import ProcessPoolExecutor  # Parallel HTML to text
+
+# Convert HTML to text with the html2text module if it is installed.
+# Otherwise the html2text utility is run.
+try:
+    import html2text
+except ImportError:
+    html2text = None
 
 
 # -----------------------------------------------------------------------------
@@ -97,6 +105,33 @@ RUN_NEXT_FILE = os.getenv('RUN_NEXT', default='running_next')
 RUN_NOW_FILE = os.getenv('RUN_NOW', default='running_now')
 RUN_ADM_FILE = os.getenv('RUN_ADM', default='manage_next')
 
+# Setup the line width and the command to run the html2text utility
+if platform.machine() == 'x86_64':  # Which machine is this?
+    # This command is for when testing on Linux-Mint
+    H2T_WIDTH = 0
+    H2T_CMD = ['html2text', '-b', '0', '--ignore-links']
+else:
+    # This is the command for when running on a Raspberry Pi
+    H2T_WIDTH = 300
+    H2T_CMD = ['html2text', '-width', '300']
+
+# Characters to fix in the html2text output. Non-breaking spaces become
+# real spaces, zero width spaces and byte order marks are removed.
+H2T_FIX_TABLE = str.maketrans({'\xa0': ' ', '\u200b': '', '\ufeff': ''})
+
+# Separator put between the HTML files when they are converted together
+BATCH_TOKEN = "CD985272F78311"
+
+# Characters allowed in an email address. The dotenv file is sourced in by
+# the scripts, so quotes and other special characters must not get into it.
+EMAIL_CHARS = frozenset(string.ascii_letters + string.digits + ".-_+@")
+
+# Words accepted as true for the DEBUG command
+TRUE_WORDS = frozenset(('yes', 'on', 'true', '1', 'y'))
+
+# Global variables predefined here
+dotenv_updates = {}  # DOTENV variables to update at the end of the run
+
 # -----------------------------------------------------------------------------
 # LANGUAGE CHANGEABLE constants
 # The following texts can be translated to other languages if needed.
@@ -105,8 +140,8 @@ RUN_ADM_FILE = os.getenv('RUN_ADM', default='manage_next')
 
 # Management commands that are recognised as valid ones
 # These commands are passed to the SysAdmin task script!
-SYSADM_CMDS = ('list', 'update', 'reboot', 'screen', 'save_now',
-               'crontab', 'shutdown', 'download', 'delete')
+SYSADM_CMDS = frozenset(('list', 'update', 'reboot', 'screen', 'save_now',
+                         'crontab', 'shutdown', 'download', 'delete'))
 
 # Command words for the presentations. These are processed by this program!
 CMND_GOOGLE = 'google'  # Google Slides presentation
@@ -130,8 +165,7 @@ LOG_ERR = ('PRMSG: Unknown file extn for: %s',
            'PRMSG: Google URL is not for google slides',
            'PRMSG: Could not copy permanent file: %s',
            'PRMSG: Permanent file %s does not exist',
-           'PRMSG: No filename given with RUN command',
-           'PRMSG: Could not remove file %s')
+           'PRMSG: No filename given with RUN command')
 
 # LOG_INF are the information messages.
 LOG_INF = ('PRMSG: Updated EMAIL AUTH to: %s',
@@ -162,6 +196,56 @@ def get_filename_ext(filepath):
 # End get_filename_ext
 
 
+# -----------------------------------------------------------------------------
+# SHELL_QUOTE
+def shell_quote(text):
+    """
+    Quote the text for a shell variable in a trigger file.
+
+    The text is always put between single quotes. Any single quote in the
+    text is ended, escaped and started again, so the scripts that source
+    in the trigger file get the text exactly as it is. The quotes are
+    also used when there is nothing special in the text, because
+    sysadmin_save_now.py reads the data between the single quotes.
+
+    Arguments:
+        text -- The text to quote.
+
+    Return:
+        str -- The quoted text.
+    """
+
+    return "'" + text.replace("'", "'\"'\"'") + "'"
+# End shell_quote
+
+
+# -----------------------------------------------------------------------------
+# WRITE_TRIGGER_FILE
+def write_trigger_file(filename, text):
+    """
+    Write the text to a trigger file in one go.
+
+    The text is written to a temporary file first, which then replaces
+    the trigger file. The scripts that read the trigger file will never
+    see a partly written file.
+
+    Arguments:
+        filename -- The trigger file to write.
+        text -- The complete contents of the trigger file.
+
+    Return:
+        None
+    """
+
+    tmp_file = filename + ".tmp"
+    with open(tmp_file, 'w', encoding="utf-8") as f:
+        f.write(text)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_file, filename)
+# End write_trigger_file
+
+
 # -----------------------------------------------------------------------------
 # WRITE_NEXT_FILE
 def write_next_file(parm_cmnd, parm_data):
@@ -175,10 +259,10 @@ def write_next_file(parm_cmnd, parm_data):
     Return:
         None
     """
-    # Open a new running next file and write the cmnd and data to it.
-    with open(RUN_NEXT_FILE, 'w', encoding="utf-8") as f:
-        f.write(f"export RUN_CMND='{parm_cmnd}'\n")
-        f.write(f"export RUN_DATA='{parm_data}'\n")
+    # Write a new running next file with the cmnd and data in it.
+    write_trigger_file(RUN_NEXT_FILE,
+                       f"export RUN_CMND={shell_quote(parm_cmnd)}\n"
+                       f"export RUN_DATA={shell_quote(parm_data)}\n")
 # End write_next_file
 
 
@@ -197,11 +281,11 @@ def write_adm_file(parm_cmnd, parm_data, parm_atch):
         None
     """
 
-    # Open a new sys admin next file and write the cmnd and data to it.
-    with open(RUN_ADM_FILE, 'w', encoding="utf-8") as f:
-        f.write(f"export RUN_CMND='{parm_cmnd}'\n")
-        f.write(f"export RUN_DATA='{parm_data}'\n")
-        f.write(f"export RUN_ATCH='{parm_atch}'\n")
+    # Write a new sys admin next file with the cmnd and data in it.
+    write_trigger_file(RUN_ADM_FILE,
+                       f"export RUN_CMND={shell_quote(parm_cmnd)}\n"
+                       f"export RUN_DATA={shell_quote(parm_data)}\n"
+                       f"export RUN_ATCH={shell_quote(parm_atch)}\n")
 
     logging.debug("Written the manage file: %s.", RUN_ADM_FILE)
 
@@ -214,9 +298,9 @@ def initialise():
     """
     Initialise this program.
 
-    From the dotenv set of variables, get the logging level.
-    Set the logging level depending on the DEBUG variable from the
-    dotenv secrets file.
+    Set the logging level depending on the DEBUG variable. This is
+    exported by the calling script. If it is not in the environment, it
+    is read from the dotenv secrets file.
 
     Arguments:
         None
@@ -225,12 +309,14 @@ def initialise():
         None
     """
 
-    # Get the secrets from the dotenv file
-    secrets = dotenv.dotenv_values(DOTENV_FILE)
+    # Get the DEBUG value from the environment or else the dotenv file
+    debug_value = os.getenv('DEBUG')
+    if debug_value is None:
+        debug_value = dotenv.dotenv_values(DOTENV_FILE).get('DEBUG') or ''
 
-    # Set the logging level depending on the DEBUG value in th secrets file
+    # Set the logging level depending on the DEBUG value
     loglevel = getattr(logging, 'INFO', None)  # Default level is INFO
-    if secrets["DEBUG"].lower() == "true":
+    if debug_value.lower() == "true":
         loglevel = getattr(logging, 'DEBUG', None)  # Set level to DEBUG
 
     # Setup the logging facility with message format, filename and log level
@@ -243,6 +329,115 @@ def initialise():
 # End initialise
 
 
+# -----------------------------------------------------------------------------
+# HTML_FILE_TO_TEXT
+def html_file_to_text(filename, width):
+    """
+    Convert an HTML file to text using the html2text module.
+
+    Arguments:
+        filename -- The HTML file to convert.
+        width -- Maximum line width of the text, 0 for no maximum.
+
+    Return:
+        string -- The text of the HTML file.
+    """
+
+    with open(filename, 'r', encoding="utf-8") as f:
+        converter = html2text.HTML2Text()
+        converter.ignore_links = True
+        converter.body_width = width
+        return converter.handle(f.read())
+# End html_file_to_text
+
+
+# -----------------------------------------------------------------------------
+# CONVERT_HTML
+def convert_html(filenames):
+    """
+    Convert HTML files to text using "html2text".
+
+    If the html2text Python module is installed, each file is converted
+    by this program itself. With more than one file and processor, the
+    files are converted in parallel by a pool of processes.
+    Otherwise all files are converted with a single run of the html2text
+    utility. The HTML of the files is given to it one after the other,
+    separated by a paragraph with the batch token. The text is then
+    split again at the batch token. If that does not give a text for
+    every file, each file is converted with its own run of html2text.
+    This way the start up time of html2text is paid once per run of this
+    program unless the batch split fails, and not at all when the module
+    is installed.
+
+    Arguments:
+        filenames -- List of the HTML files to convert.
+
+    Return:
+        list -- The text of each HTML file, in the same order.
+    """
+
+    # Convert the HTML files with the html2text module if available.
+    if html2text is not None:
+        workers = min(len(filenames), os.cpu_count() or 1)
+        if workers > 1:
+            with ProcessPoolExecutor(max_workers=workers) as executor:
+                return list(executor.map(html_file_to_text, filenames,
+                                         [H2T_WIDTH] * len(filenames)))
+        return [html_file_to_text(filename, H2T_WIDTH)
+                for filename in filenames]
+
+    if len(filenames) > 1:
+        contents = []
+        for filename in filenames:
+            with open(filename, 'r', encoding="utf-8") as f:
+                contents.append(f.read())
+
+        # Convert all the HTML files with one run of html2text.
+        separator = f"\n<p>{BATCH_TOKEN}</p>\n"
+        try:
+            output = subprocess.run(H2T_CMD, input=separator.join(contents),
+                                    capture_output=True, check=True,
+                                    encoding="utf-8").stdout
+        except subprocess.CalledProcessError as err:
+            logging.debug("html2text batch failed: %s", err)
+        else:
+            texts = output.split(BATCH_TOKEN)
+            if len(texts) == len(filenames):
+                return texts
+            logging.debug("html2text batch gave %d texts", len(texts))
+
+    # Convert each HTML file with its own run of html2text.
+    return [subprocess.check_output(H2T_CMD + [filename], text=True)
+            for filename in filenames]
+# End convert_html
+
+
+# -----------------------------------------------------------------------------
+# INDEX_ATTACHMENTS
+def index_attachments():
+    """
+    Index the files in the attachment folder by their message prefix.
+
+    The attachment filenames start with the prefix of the message they
+    came with, followed by an underscore, e.g. "msg12_slides.ppsx".
+
+    Arguments:
+        None
+
+    Return:
+        dict -- For each message prefix, the sorted list of its
+                attachment filenames.
+    """
+
+    atch_index = {}
+    for atch_name in sorted(os.listdir(ATCH_FOLDER)):
+        prefix = atch_name.split('_', 1)[0]
+        atch_index.setdefault(prefix, []).append(atch_name)
+
+    return atch_index
+# End index_attachments
+
+
 # -----------------------------------------------------------------------------
 # PROCESS_FILES
 def process_files():
@@ -253,10 +448,13 @@ def process_files():
     list of files to remove. This function only deals with message files
     with the extension ".html" and ".txt". Any files not having the
     correct file extension are ignored and are deleted.
-    HTML files are converted to text using the "html2text" utility.
+    HTML files are all converted to text first using the "html2text"
+    utility.
     If a .txt file has a corresponding .html file, it is ignored,
     otherwise the file contents is used.
     The text data is then processed by the "process_data" function.
+    The attachment folder is listed and indexed only once for all the
+    messages.
 
     Arguments:
         None
@@ -268,13 +466,42 @@ def process_files():
     # Create an empty list of emails to remove
     remove_list = []
 
+    # Get the files in the messages folder, sorted by name, with a single
+    # scan of the folder. Hidden files are left out. Files that are not
+    # message files are not processed, they are only removed.
+    # The HTML files and their names without the extension are kept
+    # separately as well.
+    filenames = []
+    html_files = []
+    html_names = set()
+    with os.scandir(MESG_FOLDER) as entries:
+        for entry in entries:
+            if not entry.is_file() or entry.name.startswith('.'):
+                continue
+            if not entry.name.startswith(FILE_PREFIX):
+                remove_list.append(entry.path)
+                continue
+            filenames.append(entry.path)
+            fname, extn = os.path.splitext(entry.name)
+            if extn.lower() == HTML_SUFFIX:
+                html_files.append(entry.path)
+                html_names.add(fname)
+    filenames.sort()
+    html_files.sort()
+
     # Check that the messages folder is not empty, else exit this function
-    if not os.listdir(MESG_FOLDER):
+    if not filenames:
         logging.debug("No files found in messages folder")
         return remove_list
 
+    # Get the files in the attachment folder by message prefix
+    atch_index = index_attachments()
+
+    # Convert the HTML files
+    html_texts = dict(zip(html_files, convert_html(html_files)))
+
     # For each file in the messages folder
-    for filename in sorted(glob.glob(MESG_FOLDER + '/*')):
+    for filename in filenames:
         # Get the filename and suffix in separate variables
         fname, extn = get_filename_ext(filename)
         logging.debug("filename: %s fname: %s extn: %s", filename, fname, extn)
@@ -283,19 +510,10 @@ def process_files():
             # Process the HTML version of the email message
             logging.debug("HTML file processing %s", filename)
 
-            # Setup the command to run the html2text utility
-            if platform.machine() == 'x86_64':  # Which machine is this?
-                # This command is for when testing on Linux-Mint
-                cmd = ['html2text', '-b', '0', '--ignore-links', filename]
-            else:
-                # This is the command for when running on a Raspberry Pi
-                cmd = ['html2text', '-width', '300', filename]
-
-            # Convert the HTML file to text using the HTML2TEXT program.
-            html_lines = subprocess.check_output(cmd, text=True)
-            # Replace non-breaking spaces with real spaces.
-            html_lines = html_lines.replace(u'\xa0', ' ')
-            process_data(html_lines, fname)
+            # Get the text of the HTML file.
+            # Fix the non-breaking spaces and other special characters.
+            html_lines = html_texts[filename].translate(H2T_FIX_TABLE)
+            process_data(html_lines.splitlines(), fname, atch_index)
             remove_list.append(filename)
 
         elif extn.lower() == TEXT_SUFFIX:
@@ -306,14 +524,14 @@ def process_files():
 
             # Check that the TXT file does not have an HTML file also
             # because then we can ignore the TXT file.
-            if os.path.isfile(MESG_FOLDER + "/" + fname + HTML_SUFFIX):
+            if fname in html_names:
                 remove_list.append(filename)
                 logging.debug("Ignoring this txt file")
             else:
                 logging.debug("--TXT is only one")
+                # Process the lines as they are read from the file
                 with open(filename, 'r', encoding="utf-8") as f:
-                    text_lines = f.read()
-                process_data(text_lines, fname)
+                    process_data(f, fname, atch_index)
                 remove_list.append(filename)
 
         else:
@@ -328,7 +546,7 @@ def process_files():
 
 # -----------------------------------------------------------------------------
 # PROCESS_DATA
-def process_data(text_data, mesg_prefix):
+def process_data(text_data, mesg_prefix, atch_index):
     """
     Process the data taken from a file in the messages folder.
 
@@ -340,8 +558,10 @@ def process_data(text_data, mesg_prefix):
     on the command and data provided.
 
     Arguments:
-        text_data -- The text data (multiple lines) to be processed.
+        text_data -- The lines of text to be processed. This can be a
+                     list of lines or an open text file.
         mesg_prefix -- Prefix of the message file being processed.
+        atch_index -- The attachment filenames by message prefix.
 
     Return:
         None
@@ -350,90 +570,132 @@ def process_data(text_data, mesg_prefix):
     # For every line in the text data, process the words in the line.
     logging.debug("Processing the data")
 
-    for line in text_data.splitlines():
-        line = line.strip()  # Get rid of leading/trailing spaces
-        if len(line) < 1:  # If line is empty
-            continue  # ignore the line and get next one
-
-        logging.debug("Doing line: %s", line)
+    # Check once if the debug messages are logged at all, as there are
+    # debug messages for every line.
+    debug_on = logging.getLogger().isEnabledFor(logging.DEBUG)
 
+    for line in text_data:
         # Get all the words in a line into a word list
         word_list = line.split()
 
         # If there are no words in the list (empty line), ignore this line.
-        if len(word_list) == 0:
+        if not word_list:
             continue
 
         # Get the first word in the line, which is the command to execute.
         command = word_list[0].lower()
-        logging.debug("Found first word: %s", command)
-
-        # Get the rest of the words after cmd. This is now in a CSV format.
-        rest_of_list = ','.join(word_list[1:])
-        logging.debug("Rest of list is: %s", rest_of_list)
-
-        # Process the command.
-        if command in (CMND_AUTH1, CMND_AUTH2):
-            if len(rest_of_list) > 0:   # At least one word in the line
-                logging.debug("Found %s List: %s", word_list[0], rest_of_list)
-                update_email_auth(rest_of_list)
-            else:
-                # If there are no words in the list then do not update the
-                # email authorisation list.
-                logging.error(LOG_ERR[1])
-
-        elif command == CMND_DEBUG:
-            # Debug command. Change the dotenv file setting
-            update_debug_var(rest_of_list)
-            logging.info(LOG_INF[2], command)
-
-        elif command == CMND_GOOGLE:
-            # Google will set the parameters for the next presentation to
-            # run and when program terminates this triggers a restart.
-            write_google_data(rest_of_list)
-            logging.info(LOG_INF[2], command)
-
-        elif command in (CMND_POWERP, CMND_IMPRESS):
-            # PowerPoint or Impress command.
-            # Copy the data to the running_next file
-            write_pp_impress_data(mesg_prefix)
-            logging.info(LOG_INF[2], command)
-
-        elif command == CMND_RUN:
-            # RUN command found. Create the running_next file from the data
-            write_run_file(rest_of_list)
-            logging.info(LOG_INF[2], command)
-
-        elif command in (CMND_START, CMND_RSTART):
-            # Copy the running now file to the running next file.
-            # This should trigger a restart when this program terminates.
-            try:
-                shutil.copy(RUN_NOW_FILE, RUN_NEXT_FILE)
-            except Exception:
-                logging.error(LOG_ERR[2])
-
-            logging.info(LOG_INF[2], command)
-
-        elif command in (CMND_STOP, CMND_HALT):
-            # These commands simply create a running_next file with just the
-            # command and the data left empty
-            write_next_file(CMND_STOP, '')
-            logging.info(LOG_INF[2], command)
+        if debug_on:
+            logging.debug("Doing line: %s", line.strip())
+            logging.debug("Found first word: %s", command)
+
+        # Process the command. Look up the function for the command in the
+        # command table.
+        handler = COMMANDS.get(command)
+        if handler is not None:
+            # Get the rest of the words after cmd. This is now in a CSV
+            # format.
+            rest_of_list = ','.join(word_list[1:])
+            if debug_on:
+                logging.debug("Rest of list is: %s", rest_of_list)
+            handler(command, rest_of_list, mesg_prefix, atch_index)
 
         elif command in SYSADM_CMDS:
             # These command generate a manage_next file with the three
             # variables for the management process
-            write_manage_next(mesg_prefix, command, line)
+            write_manage_next(mesg_prefix, command, line, atch_index)
 
-        else:
-            # Ignore all unknown commands
-            # This statement is here for completeness
-            pass
+        # Ignore all unknown commands
 
     # End for line in text_data
 # End process_data
 
 
+# -----------------------------------------------------------------------------
+# COMMAND FUNCTIONS
+# Each function processes one or more commands found in a message. They all
+# have the same arguments:
+#     command -- The command found, in lowercase.
+#     rest_of_list -- The rest of the words of the line, separated by commas.
+#     mesg_prefix -- Prefix of the message file being processed.
+#     atch_index -- The attachment filenames by message prefix.
+def do_email_auth(command, rest_of_list, mesg_prefix, atch_index):
+    """Update the authorised email sender list."""
+    if len(rest_of_list) > 0:   # At least one word in the line
+        logging.debug("Found %s List: %s", command, rest_of_list)
+        update_email_auth(rest_of_list)
+    else:
+        # If there are no words in the list then do not update the
+        # email authorisation list.
+        logging.error(LOG_ERR[1])
+
+
+def do_debug(command, rest_of_list, mesg_prefix, atch_index):
+    """Debug command. Change the dotenv file setting."""
+    update_debug_var(rest_of_list)
+    logging.info(LOG_INF[2], command)
+
+
+def do_google(command, rest_of_list, mesg_prefix, atch_index):
+    """
+    Google will set the parameters for the next presentation to run and
+    when program terminates this triggers a restart.
+    """
+    write_google_data(rest_of_list)
+    logging.info(LOG_INF[2], command)
+
+
+def do_presentation(command, rest_of_list, mesg_prefix, atch_index):
+    """
+    PowerPoint or Impress command. Copy the data to the running_next
+    file.
+    """
+    write_pp_impress_data(mesg_prefix, atch_index)
+    logging.info(LOG_INF[2], command)
+
+
+def do_run(command, rest_of_list, mesg_prefix, atch_index):
+    """RUN command found. Create the running_next file from the data."""
+    write_run_file(rest_of_list)
+    logging.info(LOG_INF[2], command)
+
+
+def do_start(command, rest_of_list, mesg_prefix, atch_index):
+    """
+    Copy the running now file to the running next file. This should
+    trigger a restart when this program terminates.
+    """
+    try:
+        shutil.copyfile(RUN_NOW_FILE, RUN_NEXT_FILE)
+    except OSError:
+        logging.error(LOG_ERR[2])
+
+    logging.info(LOG_INF[2], command)
+
+
+def do_stop(command, rest_of_list, mesg_prefix, atch_index):
+    """
+    These commands simply create a running_next file with just the
+    command and the data left empty.
+    """
+    write_next_file(CMND_STOP, '')
+    logging.info(LOG_INF[2], command)
+
+
+# The function to call for each command processed by this program
+COMMANDS = {CMND_AUTH1: do_email_auth,
+            CMND_AUTH2: do_email_auth,
+            CMND_DEBUG: do_debug,
+            CMND_GOOGLE: do_google,
+            CMND_POWERP: do_presentation,
+            CMND_IMPRESS: do_presentation,
+            CMND_RUN: do_run,
+            CMND_START: do_start,
+            CMND_RSTART: do_start,
+            CMND_STOP: do_stop,
+            CMND_HALT: do_stop}
+# End command functions
+
+
 # -----------------------------------------------------------------------------
 # UPDATE_EMAIL_AUTH
 def update_email_auth(email_list):
@@ -441,8 +703,10 @@ def update_email_auth(email_list):
     Update the authorised email list in the dotenv file.
 
     This given list will be converted to a list variable. The email
-    addresses are checked for having at least one @ sign it them.
-    If not correct, then the variable is not updated.
+    addresses are checked for having an @ sign with a name before it and
+    a domain with a dot after it. Only letters, digits and the characters
+    ".-_+@" are accepted. If not correct, then the variable is not
+    updated.
 
     Arguments:
         email_list -- list of words that were on the same line as the
@@ -452,20 +716,18 @@ def update_email_auth(email_list):
         None
     """
 
-    # Make a regular expression for validating an Email
-    regex = re.compile(r'([A-Za-z0-9]+[.-_])*[A-Za-z0-9]+'
-                       r'@[A-Za-z0-9-]+(\.[A-Z|a-z]{2,})+')
-
     # First check that all email addresses have a proper format.
     for email_adrs in email_list.split(','):
         # Check that email_adrs is a proper email address
-        if not re.fullmatch(regex, email_adrs):
+        at_pos = email_adrs.rfind('@')
+        if (at_pos <= 0 or '.' not in email_adrs[at_pos + 1:] or
+           not EMAIL_CHARS.issuperset(email_adrs)):
             logging.error(LOG_ERR[3], email_adrs)
             return
 
     # Set the EMAIL_AUTH variable to the given email list.
-    outcome = dotenv.set_key(DOTENV_FILE, "EMAIL_AUTH", email_list)
-    logging.debug("dotenv AUTH set outcome=%s", outcome)
+    # The dotenv file is updated when all messages are processed.
+    dotenv_updates["EMAIL_AUTH"] = email_list
 
     logging.info(LOG_INF[0], email_list)
 # End update_email_auth
@@ -488,13 +750,12 @@ def update_debug_var(param_list):
     # Get the arguments from the given parameter list
     arg_list = param_list.split(',')
     logging.debug("debug param_list: %s", arg_list[0])
-    # Set debug flag to True if argument[1] is yes or on, False otherwise
-    new_debug = bool(arg_list[0].lower() == 'yes' or
-                     arg_list[0].lower() == 'on' or
-                     arg_list[0].lower() == 'true')
-    # Update the dotenv file with the new debug value
-    outcome = dotenv.set_key(DOTENV_FILE, 'DEBUG', str(new_debug))
-    logging.debug("dotenv DEBUG set outcome=%s", outcome)
+    # Set debug flag to True if argument[1] is yes, on or true, False
+    # otherwise
+    new_debug = arg_list[0].lower() in TRUE_WORDS
+    # Update the dotenv file with the new debug value when all messages
+    # are processed.
+    dotenv_updates['DEBUG'] = str(new_debug)
 
     logging.info(LOG_INF[1], str(new_debug))
 # End update_debug_var
@@ -538,13 +799,13 @@ def write_google_data(rest_of_list):
 
 # -----------------------------------------------------------------------------
 # WRITE_PP_IMPRESS_DATA
-def write_pp_impress_data(fileprefix):
+def write_pp_impress_data(fileprefix, atch_index):
     """
     Write a PowerPoint or Impress running_next file.
 
-    Get a list of attachments from the attachment folder and search
-    this list for a file that starts with the file same prefix as the
-    message and ends with the suffix for PowerPoint or Impress.
+    Search the attachments of the message, found in the attachment index
+    with the file prefix of the message, for a file that ends with the
+    suffix for PowerPoint or Impress.
 
     If not found, exit the function with a False value. Ensure that
     the message filename goes into the list of messages to delete.
@@ -553,24 +814,22 @@ def write_pp_impress_data(fileprefix):
     Arguments:
         fileprefix -- The string that should be at the start of the
                       attachment file.
+        atch_index -- The attachment filenames by message prefix.
 
     Return:
         None
     """
 
-    # Get the list of files in the attachment folder
-    atch_folder = os.path.join(WORK_FOLDER, ATCH_FOLDER)
-    atch_list = list(os.listdir(atch_folder))
+    # Get the attachments of this message
+    atch_list = atch_index.get(fileprefix, [])
 
-    # If there are any files in the attachment folder
+    # If there are any attachments for this message
     if len(atch_list) > 0:
         logging.debug("Files found in attachment folder")
-        # Check if any of the files start with the message name and has
-        # the PowerPoint file extension
+        # Check if any of the files has the PowerPoint or Impress file
+        # extension
         for atch_name in atch_list:
-            if (atch_name.startswith(fileprefix) and
-               (atch_name.endswith(IMPRES_SUFFIX) or
-               atch_name.endswith(PPOINT_SUFFIX))):
+            if atch_name.endswith((IMPRES_SUFFIX, PPOINT_SUFFIX)):
                 # Attachment found
                 logging.debug("Attachment %s found", atch_name)
                 # Generate the running_next file.
@@ -608,8 +867,8 @@ def write_run_file(p_filedata):
         if os.path.isfile(perm_file):
             logging.debug("Found the permanent file %s", p_filedata)
             try:
-                shutil.copy(perm_file, RUN_NEXT_FILE)
-            except Exception:
+                shutil.copyfile(perm_file, RUN_NEXT_FILE)
+            except OSError:
                 logging.error(LOG_ERR[5], perm_file)
         else:
             logging.error(LOG_ERR[6], perm_file)
@@ -620,21 +879,23 @@ def write_run_file(p_filedata):
 
 # -----------------------------------------------------------------------------
 # WRITE_MANAGE_NEXT
-def write_manage_next(p_fileprefix,  p_cmnd, p_data):
+def write_manage_next(p_fileprefix, p_cmnd, p_data, p_atch_index):
     """
     Write the System Admin manage_next file.
 
-    The p_data is unravelled using the csv module methods. This will
-    result in a list within a list. It contains the command and data
-    provided.
-    The attachment files are checked and the one with the filename that
-    starts with the file prefix parameter is selected. If found, that is
-    used in the manage_next trigger file.
+    The p_data is split into words with the shlex module. The first word
+    is the command, the rest is the data provided. Words within double
+    quotes are kept together. If the quotes are not balanced the line is
+    simply split on white space.
+    The attachment files with the file prefix parameter are looked up in
+    the attachment index. If found, these are used in the manage_next
+    trigger file.
 
     Arguments:
         p_fileprefix -- Filename prefix used for finding attachment
         p_cmnd -- Management command
         p_data -- Data for the management command
+        p_atch_index -- The attachment filenames by message prefix
 
     Return:
         None
@@ -643,42 +904,54 @@ def write_manage_next(p_fileprefix,  p_cmnd, p_data):
     # Unravel the line of text and get the command and filename from the line
     # There may be more than one data items after the command but those
     # are ignored.
-    lines = p_data.splitlines()
-    words = list(csv.reader(lines, delimiter=' ', quotechar='"'))
-    # words is now a one element list with an embedded list in it
-    mng_data = ''  # Define data variable and set to empty
-    atch_file = ''  # Attachment file name when found
-    mng_data = ' '.join(words[0][1:]).strip()
+    try:
+        words = shlex.split(p_data)
+    except ValueError:
+        words = p_data.split()
+    mng_data = ' '.join(words[1:]).strip()
 
-    # Get the list of files in the attachment folder
-    atch_list = os.listdir(ATCH_FOLDER)
-
-    # If there are any files in the attachment folder
-    if len(atch_list) > 0:
-        logging.debug("Files found in attachment folder")
-        # Check if any of the files start with the message name (fileprefix)
-        for atch_name in atch_list:
-            if atch_name.startswith(p_fileprefix):
-                # Attachment found
-                logging.debug("Attachment %s found", atch_name)
-                # Make sure multiple attachments are concatenated properly
-                if atch_file == '':
-                    atch_file = atch_name
-                else:
-                    atch_file = atch_file + "," + atch_name
-    else:
-        logging.debug("No files in attachment folder found")
+    # Get the attachments of this message (fileprefix), separated by commas
+    atch_file = ",".join(p_atch_index.get(p_fileprefix, []))
+    logging.debug("Attachments found: %s", atch_file)
 
     # Generate the running_next file
     write_adm_file(p_cmnd, mng_data, atch_file)
 # End write_manage_next
 
 
+# -----------------------------------------------------------------------------
+# SAVE_DOTENV_UPDATES
+def save_dotenv_updates():
+    """
+    Write the updated variables to the dotenv file.
+
+    The dotenv file is read once and only the variables that have a new
+    value are written to it. When a variable has been updated more than
+    once, only the last value is written.
+
+    Arguments:
+        None
+
+    Return:
+        None
+    """
+
+    current = dotenv.dotenv_values(DOTENV_FILE)
+    for key, value in dotenv_updates.items():
+        if current.get(key) != value:
+            outcome = dotenv.set_key(DOTENV_FILE, key, value)
+            logging.debug("dotenv %s set outcome=%s", key, outcome)
+
+    dotenv_updates.clear()
+# End save_dotenv_updates
+
+
 # -----------------------------------------------------------------------------
 # REMOVE_FILES
 def remove_files(remove_list):
     """
     Remove all the files that are in the removal list given.
+    A file that has already gone is simply skipped.
 
     Arguments:
         remove_list -- The list of files to be removed.
@@ -690,10 +963,8 @@ def remove_files(remove_list):
     logging.debug("Removing the files")
 
     for filename in remove_list:
-        try:
-            os.remove(filename)
-        except FileNotFoundError:
-            logging.error(LOG_ERR[8], filename)
+        with suppress(FileNotFoundError):
+            os.unlink(filename)
 # End remove_files
 
 
@@ -707,6 +978,7 @@ def main():
     Process the message files and return a list of message files that
     can be deleted. This process creates one or more 'command' files
     that are used by other scripts to perform specific functions.
+    Save any updated dotenv variables.
     If there are any message files to be deleted, remove them.
 
     Arguments:
@@ -722,6 +994,10 @@ def main():
     #   Process the files, returning the list of files to delete.
     remove_list = process_files()
 
+    #   Save the dotenv variables changed by the commands, if any.
+    if dotenv_updates:
+        save_dotenv_updates()
+
     #   Remove the processed files as per the remove_list
     if len(remove_list) > 0:  # if any messages in the list
         logging.debug("Remove list= %s", remove_list)
@@ -3,17 +3,23 @@
 Send an email using an RFC 5322 formatted file.
 
 Synopsis:
-    send_email.py  message_file [...]
+    send_email.py  [message_file] [...]
 
 Description:
     This program sends emails using the contents of the message_file
-    given as arguments to this program.
+    given as arguments to this program. Without arguments, all the
+    files in the queue folder are emailed.
+    The messages are divided over up to four SMTP connections that
+    send them at the same time. Each connection sends its messages one
+    after the other. If the server drops a connection, it is opened
+    again.
     Each file must be formatted using the RFC 5322 format and contain at
     least the "To" and "Subject" header lines. Optionally it can have
     the header "Attachment" if there is a file to be attached to the
-    email. All other header lines are ignored. The "From" address will
-    be the device name and the user account name from the dotenv
-    configuration.
+    email. The header "X-Html: no" leaves out the HTML version of the
+    message text. All other header lines are ignored. The "From"
+    address will be the device name and the user account name from the
+    dotenv configuration.
     Every message is tested for properly formatted "To:" address and
     that there is a "Subject:" line. If these checks fail, the message
     is written to the "other_msg" folder for inspection.
@@ -25,7 +31,7 @@ Description:
     was not send to be tried again at the next running of this program.
 
 Arguments:
-    message_file -- The RFC 5322 formatted message(s).
+    message_file -- The RFC 5322 formatted message(s). Optional.
 
 Return:
     0 -- No errors detected.
@@ -66,41 +72,84 @@ along with this program. If not, see <https://www.gnu.org/licenses/>.
 
 # -----------------------------------------------------------------------------
 # IMPORT THE MODULES
-import email
 import smtplib
 import sys
 import os
 import re
 import shutil
 import socket
-import dotenv
 import logging  # For logging errors etc.
 import mimetypes  # For detecting attachment MIME type
+import threading  # For the SMTP object of each sending thread
+from concurrent.futures import ThreadPoolExecutor  # Parallel sending
+from contextlib import suppress  # Ignore errors closing a failed link
 from email.message import EmailMessage
-from urllib.request import urlopen
+from email.parser import HeaderParser
 
 
 # -----------------------------------------------------------------------------
 # VARIABLES and CONSTANTS
 # Set the filenames for the logging messages and the dotenv file.
+# The dotenv file is in the folder this program is in.
+WORK_FOLDER = os.path.dirname(os.path.realpath(__file__))
 LOG_FNAME = os.getenv('PI_SIGN_LOG', default='pi_signage.log')
-DOTENV_FILE = os.path.join(os.getcwd(), ".env")
+DOTENV_FILE = os.path.join(WORK_FOLDER, ".env")
 
 # Get the name of this program for use in the debug messages.
 progname = os.path.basename(sys.argv[0])
 
+# Get the hostname of this device to use in the From address
+HOSTNAME = socket.gethostname()
+
 # Get the the folder names used in this program
 UNQUEUE_DIR = os.getenv('UNQUEUE_DIR', default='./unqueue')
 QUEUE_DIR = os.getenv("QUEUE_DIR", default='./queue')
 OTHR_FOLDER = os.getenv("OTHR_FOLDER", default='./other_msg')
 
+# Regular expressions for getting the email address from the TO line and
+# for checking that it is a proper email address. Each separator in the
+# name part must be followed by a letter or digit, so a long invalid address
+# can not make the check take exponential time.
+ANGLE_REGEX = re.compile(r"<(.+?)>")
+ADDRESS_REGEX = re.compile(r'[A-Za-z0-9]+(?:[.\-_][A-Za-z0-9]+)*'
+                           r'@[A-Za-z0-9-]+(?:\.[A-Za-z]{2,})+')
+
+# Seconds to wait for the SMTP server before giving up
+SMTP_TIMEOUT = 10
+
+# Maximum number of SMTP connections sending messages at the same time
+SMTP_LINKS = 4
+
+# MIME types of the usual attachment files. Other files are looked up in the
+# mimetypes database, which is only loaded when it is needed.
+ATTACH_TYPES = {
+    '.ppsx': 'application/'
+             'vnd.openxmlformats-officedocument.presentationml.slideshow',
+    '.pptx': 'application/'
+             'vnd.openxmlformats-officedocument.presentationml.presentation',
+    '.odp': 'application/vnd.oasis.opendocument.presentation',
+    '.pdf': 'application/pdf',
+    '.png': 'image/png',
+    '.jpg': 'image/jpeg',
+    '.jpeg': 'image/jpeg',
+    '.txt': 'text/plain',
+    '.log': 'text/plain'}
+
+# Parser for the header lines of the message files. The body is not parsed.
+HEADER_PARSER = HeaderParser()
+
+# HTML put before and after the message text for the HTML part of the email
+HTML_START = ('<html>\n<body>\n'
+              '<pre style="font-family:\'Courier new\', monospace; '
+              'font-size:100%;">\n')
+HTML_END = '\n</pre>\n</body>\n</html>'
+
 # Define the global variables
 smtp_server = ""  # SMTP server name
 smtp_port = ""  # SMTP server port number
 mail_username = ""  # User name of email account
 mail_password = ""  # Password of email account
-hostname = ''  # Name of the device this program is running on
-smtplink = ''  # SMTP object
+thread_data = threading.local()  # The SMTP object of each sending thread
 
 # -----------------------------------------------------------------------------
 # LANGUAGE SPECIFIC constants
@@ -117,7 +166,6 @@ LOG_ERR = ('SNDEM: No internet access',
            'SNDEM: %s: SUBJECT is empty',
            'SNDEM: Could not open file: %s',
            'SNDEM: Unable to send email: %s Error: %s',
-           'SNDEM: Insufficient arguments',
            'SNDEM: Attachment file not found: %s')
 
 
@@ -128,9 +176,8 @@ def initialise():
     Initialise the program.
 
     Declare variables used in other parts of the program as Global.
-    Set the hostname to the name of the device for use in the From: line
-    of the email message.
-    From the dotenv file, get the user and server data.
+    Get the user and server data from the environment, as exported by
+    send_email.sh. If they are not there, read them from the dotenv file.
     Set the logging level depending on the value of the dotenv DEBUG
     variable.
 
@@ -142,13 +189,14 @@ def initialise():
     """
 
     # Define these variables as Global as they are used in other functions.
-    global smtp_server, smtp_port, mail_username, mail_password, hostname
-
-    # Get the hostname of this device to use in the From address
-    hostname = socket.gethostname()
+    global smtp_server, smtp_port, mail_username, mail_password
 
-    #   Get the secrets from the Dotenv file
-    secrets = dotenv.dotenv_values(DOTENV_FILE)
+    #   Get the secrets from the environment or else from the Dotenv file
+    if 'SMTP_SERVER' in os.environ:
+        secrets = os.environ
+    else:
+        import dotenv  # Only needed when not run by send_email.sh
+        secrets = dotenv.dotenv_values(DOTENV_FILE)
     mail_username = secrets["USERNAME"]
     mail_password = secrets["PASSWORD"]
     smtp_server = secrets['SMTP_SERVER']
@@ -156,7 +204,7 @@ def initialise():
 
     # Set the logging level depending on the DEBUG value in th secrets file
     loglevel = getattr(logging, 'INFO', None)  # Default level is INFO
-    if secrets["DEBUG"].lower() == "true":
+    if secrets.get("DEBUG", "").lower() == "true":
         loglevel = getattr(logging, 'DEBUG', None)  # Set level to DEBUG
 
     # Setup the logging facility with message format, filename and log level
@@ -173,8 +221,9 @@ def open_smtp_server():
     """
     Open and connect to the SMTP server.
 
-    First check that we have internet access. Then open a link to the
-    SMTP server and log-on to the email account.
+    Open a link to the SMTP server and log-on to the email account. If
+    the server can not be reached, there is no internet access.
+    Each sending thread has its own SMTP link, kept in thread_data.
 
     Arguments:
         None
@@ -184,22 +233,21 @@ def open_smtp_server():
         False - There is no internet access or SMTP logon failed
     """
 
-    # Define the smtplink variable as Global
-    global smtplink
-
-    # Check that there is internet access.
-    try:
-        urlopen('https://docs.google.com/', timeout=3)
-    except Exception:
-        logging.error(LOG_ERR[0])
-        return False
-
     # Open the email server and logon to the mail account
     try:
-        smtplink = smtplib.SMTP(smtp_server, port=smtp_port)
+        smtplink = smtplib.SMTP(smtp_server, port=smtp_port,
+                                timeout=SMTP_TIMEOUT)
+        thread_data.smtplink = smtplink
         smtplink.starttls()
         smtplink.login(mail_username, mail_password)
         logging.debug("Logged onto the email service")
+    except smtplib.SMTPException:
+        logging.error(LOG_ERR[1])
+        return False
+    except OSError:
+        # Server name not found, no route or timed out.
+        logging.error(LOG_ERR[0])
+        return False
     except Exception:
         logging.error(LOG_ERR[1])
         return False
@@ -208,6 +256,62 @@ def open_smtp_server():
 # End open_smtp_server
 
 
+# -----------------------------------------------------------------------------
+# RESET_SMTP_LINK
+def reset_smtp_link():
+    """
+    Reset the SMTP link after a message was not emailed.
+
+    A RSET command clears what is left of the failed message on the
+    server, so the next message can be sent over the same link. If the
+    server has dropped the link, it is closed and opened again.
+
+    Arguments:
+        None
+
+    Return:
+        True -- The SMTP link can be used for the next message.
+        False -- The SMTP link could not be opened again.
+    """
+
+    try:
+        thread_data.smtplink.rset()
+    except (smtplib.SMTPException, OSError):
+        logging.debug("%s: SMTP link lost, opening it again", progname)
+        with suppress(Exception):
+            thread_data.smtplink.close()
+        return open_smtp_server()
+
+    return True
+# End reset_smtp_link
+
+
+# -----------------------------------------------------------------------------
+# MOVE_FILE
+def move_file(p_filename, p_folder):
+    """
+    Move a message file to the given folder.
+
+    The folders are normally on the same file system, so the file is
+    simply renamed. If that is not possible, shutil is used to copy the
+    file and remove the original.
+
+    Arguments:
+        p_filename -- Name of the message file to move.
+        p_folder -- The folder to move the file to.
+
+    Return:
+        None
+    """
+
+    newname = os.path.join(p_folder, os.path.basename(p_filename))
+    try:
+        os.replace(p_filename, newname)
+    except OSError:
+        shutil.move(p_filename, newname)
+# End move_file
+
+
 # -----------------------------------------------------------------------------
 # EMAIL_CHECKS
 def email_checks(p_to_adrs, p_subject, p_msgname):
@@ -237,15 +341,12 @@ def email_checks(p_to_adrs, p_subject, p_msgname):
 
     # Extract the email address part from the TO line if possible
     try:
-        regex = "<(.+?)>"
-        mail_adrs = re.search(regex, p_to_adrs).group(1)
+        mail_adrs = ANGLE_REGEX.search(p_to_adrs).group(1)
     except AttributeError:
         mail_adrs = p_to_adrs
 
     # Check that TO is a proper email address
-    regex = re.compile(r'([A-Za-z0-9]+[.-_])*[A-Za-z0-9]+'
-                       r'@[A-Za-z0-9-]+(\.[A-Z|a-z]{2,})+')
-    if not re.fullmatch(regex, mail_adrs):
+    if not ADDRESS_REGEX.fullmatch(mail_adrs):
         logging.error(LOG_ERR[3], p_msgname, mail_adrs)
         return False
 
@@ -268,6 +369,7 @@ def send_the_message(p_filename, p_from_adrs):
     Extract from the header the "To" and "Subject" information.
     If the "Attachment" header is present, then the file named
     on this line is to be attached to the email message.
+    If the "X-Html" header is "no", only the plain text is sent.
     Other header lines in the message are ignored.
 
     Arguments:
@@ -281,31 +383,32 @@ def send_the_message(p_filename, p_from_adrs):
 
     # Open the RFC5322 message, get the envelope data and message text.
     try:
-        fd = open(p_filename, 'r', encoding="utf-8")
+        with open(p_filename, 'r', encoding="utf-8") as fd:
+            mail_text = fd.read()
     except Exception:
         # If the message file is not found, error message and return False.
         logging.error(LOG_ERR[5], p_filename)
         return False
 
-    # Parse the info from an RFC 5322 formatted file.
-    mail_data = email.message_from_file(fd)
+    # Split the RFC 5322 formatted text at the first empty line into the
+    # header lines and the email payload. Only the header lines are parsed.
+    mail_header, _, mail_mesg = mail_text.partition('\n\n')
+    mail_data = HEADER_PARSER.parsestr(mail_header)
     # Get the email TO, SUBJECT data from the file.
     mail_to = mail_data.get('To')
     mail_subject = mail_data.get('Subject')
     # Get the attachment line. If not there, it results in a None value.
     mail_attach = mail_data.get('Attachment')
-    # Get the email payload.
-    mail_mesg = mail_data.get_payload(decode=False)
-    fd.close()  # CLose the message file now.
+    # Check if the HTML version of the message text is wanted.
+    mail_html = mail_data.get('X-Html', 'yes').strip().lower() != 'no'
 
     # Do some sanity checks on the TO and SUBJECT data
     if not email_checks(mail_to, mail_subject, p_filename):
         # There is a problem with the message itself. Move the message to the
         # other_msg folder for inspection by the System Administrator.
-        newname = os.path.join(OTHR_FOLDER, os.path.basename(p_filename))
         # Move the file to the other_msg folder and ignore any errors
         try:
-            shutil.move(p_filename, newname)
+            move_file(p_filename, OTHR_FOLDER)
         except Exception:
             pass
         return False  # Exit function with failure
@@ -321,15 +424,11 @@ def send_the_message(p_filename, p_from_adrs):
     # Add the plain text part of the message.
     message.set_content(mail_mesg, subtype='plain')
 
-    # Turn message body into an HTML object and add.
-    html = f'''<html>
-<body>
-<pre style="font-family:'Courier new', monospace; font-size:100%;">
-{mail_mesg}
-</pre>
-</body>
-</html>'''
-    message.set_content(html, subtype='html')
+    # Turn message body into an HTML object and add it as the alternative
+    # to the plain text, unless this is not wanted.
+    if mail_html:
+        message.add_alternative(HTML_START + mail_mesg + HTML_END,
+                                subtype='html')
 
     # Add the attachment if this is requested,
     if mail_attach:
@@ -338,11 +437,14 @@ def send_the_message(p_filename, p_from_adrs):
             basename = os.path.basename(mail_attach)
 
             # Get the MIME main and subtypes
-            ctype, encode = mimetypes.guess_type(mail_attach)
-            if ctype is None or encode is not None:
-                # No guess could be made, or the file is encoded (compressed),
-                # so use a generic type.
-                ctype = 'application/octet-stream'
+            extn = os.path.splitext(mail_attach)[1].lower()
+            ctype = ATTACH_TYPES.get(extn)
+            if ctype is None:
+                ctype, encode = mimetypes.guess_type(mail_attach)
+                if ctype is None or encode is not None:
+                    # No guess could be made, or the file is encoded
+                    # (compressed), so use a generic type.
+                    ctype = 'application/octet-stream'
 
             # Get the MIME types for adding to the attachment
             maintype, subtype = ctype.split('/', 1)
@@ -355,12 +457,21 @@ def send_the_message(p_filename, p_from_adrs):
                                        filename=basename)
         else:
             # If file not been found, log error message, but do send email
-            logging.error(LOG_ERR[8], mail_attach)
+            logging.error(LOG_ERR[7], mail_attach)
 
-    # Send the email message created above.
+    # Send the email message created above. If the server has dropped the
+    # connection, open it again and try once more.
     outcome = True  # Just making sure this is defined
     try:
-        smtplink.sendmail(mail_username, mail_to, message.as_string())
+        try:
+            thread_data.smtplink.send_message(message, mail_username,
+                                              [mail_to])
+        except smtplib.SMTPServerDisconnected:
+            logging.debug("%s: SMTP server disconnected", progname)
+            if not open_smtp_server():
+                raise
+            thread_data.smtplink.send_message(message, mail_username,
+                                              [mail_to])
         logging.debug("%s: Emailed the message: %s", progname, p_filename)
         outcome = True
     except Exception as errormsg:
@@ -372,14 +483,12 @@ def send_the_message(p_filename, p_from_adrs):
     # where the sending will be retried at a later time
     if outcome:
         # Move the file to the unqueue folder for deleting
-        newname = os.path.join(UNQUEUE_DIR, os.path.basename(p_filename))
-        shutil.move(p_filename, newname)
+        move_file(p_filename, UNQUEUE_DIR)
     else:
         # There was an error sending the message, move it to the queue folder
-        newname = os.path.join(QUEUE_DIR, os.path.basename(p_filename))
         try:
             # Move the mail file to the queue folder and ignore any errors
-            shutil.move(p_filename, newname)
+            move_file(p_filename, QUEUE_DIR)
         except Exception:
             pass
 
@@ -387,19 +496,67 @@ def send_the_message(p_filename, p_from_adrs):
 # End send_the_message
 
 
+# -----------------------------------------------------------------------------
+# SEND_FILES
+def send_files(p_mail_files, p_from_adrs):
+    """
+    Email the messages in the given files over one SMTP link.
+
+    Open the SMTP link and logon to the email account. If that fails,
+    return. Send the messages one after the other. After an error the
+    SMTP link is reset. If that fails, the other messages are left for
+    the next run. Close the SMTP link when done.
+    This function is run by each of the sending threads.
+
+    Arguments:
+        p_mail_files -- List of the message files to email.
+        p_from_adrs -- The sender address for the emails to use.
+
+    Return:
+        0 -- Emailed all messages OK
+        1 -- Error detected. See the logging messages file.
+        3 -- SMTP link could not be established.
+    """
+
+    # Open the SMTP link and logon to the email server
+    if not open_smtp_server():
+        return 3  # Problem with connecting to the email server
+
+    # Set the outcome to OK, any errors detected will change this.
+    outcome = 0
+
+    # For each message file, email the message.
+    for mail_file in p_mail_files:
+        # Send the email and set the outcome of this function. After a
+        # failure, reset the SMTP link for the next message. If the link is
+        # lost, leave the other messages for the next run.
+        if not send_the_message(mail_file, p_from_adrs):
+            outcome = 1
+            if not reset_smtp_link():
+                return 3
+
+    try:
+        thread_data.smtplink.quit()
+    except (smtplib.SMTPException, OSError):
+        pass  # The messages have been sent, so ignore any error
+
+    return outcome
+# End send_files
+
+
 # -----------------------------------------------------------------------------
 # MAIN
 def main():
     """
     Main control of sending email in an RFC 5322 formatted file.
 
+    The arguments are the RFC 5322 formatted message filenames. If there
+    are no arguments, get all the files in the queue folder. If there
+    are no files to email, or no queue folder, exit.
     Initialise the program and its global variables.
-    Check that there is at least one argument given. This must be an
-    RFC 5322 formatted message filename.
-    Call the function to open the SMTP link and to logon to the email
-    account. This involves an internet access check. If failed, exit.
-    Call the function to send the email. Outcome is True if the email
-    was send successfully and False if there was an error detected.
+    Divide the files over up to SMTP_LINKS threads. Each thread opens
+    its own SMTP link and emails its files. The exit status is the
+    worst outcome of the threads.
     When a file has been emailed, it is moved to the "unqueu" folder so
     that it can be deleted by the script in which this program is run.
     Message file that was not send correctly is moved back to the queue
@@ -414,33 +571,43 @@ def main():
         3 -- SMTP link could not be established.
     """
 
+    # Get the message files from the arguments or else from the queue folder
+    if len(sys.argv) > 1:
+        mail_files = sys.argv[1:]
+    else:
+        try:
+            with os.scandir(QUEUE_DIR) as entries:
+                mail_files = sorted(entry.path for entry in entries
+                                    if entry.is_file())
+        except (FileNotFoundError, NotADirectoryError):
+            mail_files = []  # No queue folder, so nothing to email
+
+    # If there is nothing to email, exit with status 0 before the dotenv
+    # file is read and the logging is set up.
+    if not mail_files:
+        sys.exit(0)
+
     # Initialise the program
     initialise()
     logging.debug("===== Started %s", progname)
+    logging.debug("Files to email: %d", len(mail_files))
 
-    # Set the exit status to OK, any errors detected will change this.
-    outcome = 0
-
-    # Check that there are any arguments. If not, exit with status 1
-    if len(sys.argv) < 2:
-        logging.error(LOG_ERR[7])
-        sys.exit(1)
-
-    # Open the SMTP link and logon to the email server
-    if not open_smtp_server():
-        sys.exit(3)  # Problem with connecting to the email server
-
-    # For each argument passed, email the message.
-    for mail_file in sys.argv[1:]:
-        # Setup the From address line
-        from_adrs = f'{hostname} <{mail_username}>'
+    # Setup the From address line
+    from_adrs = f'{HOSTNAME} <{mail_username}>'
 
-        # Send the email and set the program exit status to the outcome of the
-        # function.
-        if not send_the_message(mail_file, from_adrs):
-            outcome = 1
+    # Email the files. With more than one file, divide the files over the
+    # threads, each with its own SMTP link.
+    links = min(SMTP_LINKS, len(mail_files))
+    if links == 1:
+        outcome = send_files(mail_files, from_adrs)
+    else:
+        with ThreadPoolExecutor(max_workers=links) as executor:
+            outcomes = executor.map(send_files,
+                                    [mail_files[i::links]
+                                     for i in range(links)],
+                                    [from_adrs] * links)
+            outcome = max(outcomes)
 
-    smtplink.quit()
     logging.debug("===== Finished %s", progname)
     sys.exit(outcome)
 # End main
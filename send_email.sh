@@ -31,6 +31,11 @@ MYNAME=$(basename "$0")
 # Include the configuration settings for this project.
 . signage.conf
 . logging.func
+# Export the dotenv settings, so send_email.py can take them from its
+# environment instead of reading the dotenv file again.
+set -a
+. .env
+set +a
 
 #============================================================================
 # CONSTANT DEFINITIONS
@@ -59,6 +64,8 @@ else
         exit 0
     fi
     ${MY_DEBUG}  "There are queued files to email"
+    # Without arguments the program emails all files in the queue itself.
+    FILES=""
 fi
 
 ./send_email.py  ${FILES}
@@ -49,10 +49,8 @@ along with this program. If not, see <https://www.gnu.org/licenses/>.
 # MODULES
 import os
 import sys
-import re
 import shutil  # Used for copying running files
 import logging  # Debug and other message logging system.
-import dotenv  # Secrets and other configuration data
 
 
 # -----------------------------------------------------------------------------
@@ -63,8 +61,9 @@ TEXT_SUFFIX = ".txt"  # Text file name suffix
 HTML_SUFFIX = ".html"  # HTML file name suffix
 PPOINT_SUFFIX = ".ppsx"  # PowerPoint file extension
 
-# Get the working folder
-WORK_FOLDER = os.getcwd()
+# Get the working folder. This is the folder this program is in, so it
+# does not depend on where the program is started from.
+WORK_FOLDER = os.path.dirname(os.path.realpath(__file__))
 
 # Get information from the environment variables as defined in
 # the signage.conf file.
@@ -104,9 +103,9 @@ def initialise():
     """
     Initialise this program.
 
-    From the dotenv set of variables, get the logging level.
-    Set the logging level depending on the DEBUG variable from the
-    dotenv secrets file.
+    Set the logging level depending on the DEBUG variable. This is
+    exported by the calling script. If it is not in the environment, it
+    is read from the dotenv secrets file.
 
     Arguments:
         None
@@ -115,12 +114,15 @@ def initialise():
         None
     """
 
-    # Get the secrets values from the dotenv file
-    secrets = dotenv.dotenv_values(DOTENV_FILE)
+    # Get the DEBUG value from the environment or else the dotenv file
+    debug_value = os.getenv('DEBUG')
+    if debug_value is None:
+        import dotenv  # Only needed when run without the scripts
+        debug_value = dotenv.dotenv_values(DOTENV_FILE).get('DEBUG') or ''
 
-    # Set the logging level depending on the DEBUG value in the secrets file
+    # Set the logging level depending on the DEBUG value
     loglevel = getattr(logging, 'INFO', None)  # Default level is INFO
-    if secrets["DEBUG"].lower() == "true":
+    if debug_value.lower() == "true":
         loglevel = getattr(logging, 'DEBUG', None)  # Set level to DEBUG
 
     # Setup the logging facility with message format, filename and log level
@@ -142,7 +144,7 @@ def main():
     Initialise the program.
     If there is no argument with this program then log an error and exit
     the program with code 1.
-    Open the running now file and read the contents. This is necessary
+    Open the running now file and read the first two lines. This is needed
     because of the attachment that may be associated with this trigger
     file.
     If the RUN_CMND is for a PowerPoint or LibreOffice Impress
@@ -171,25 +173,24 @@ def main():
 
     perm_name = sys.argv[1]  # Get the filename for the permanent copy.
 
-    # Read the running_now file
+    # Read the first two lines of the running_now file. These are the
+    # command and the data lines.
     with open(RUN_NOW_FILE, 'r', encoding='utf8') as fd:
-        txt = fd.read()
+        cmnd_line = fd.readline()
+        data_line = fd.readline()
 
-    # Split the read data into lines. This produces a list.
-    lines = txt.splitlines()
-
-    if 'powerpoint' in lines[0] or 'impress' in lines[0]:
+    if 'powerpoint' in cmnd_line or 'impress' in cmnd_line:
         # This is a powerpoint or impress cmnd
         # so run data is the attachment filename.
 
-        # Now get the data from the second line.
-        atch_name = re.findall("'([^']*)'", lines[1])
+        # Now get the data from between the quotes on the second line.
+        atch_name = data_line.split("'", 2)[1]
 
         # Copy the attachment to the permanent folder.
-        atch_path = os.path.join(ATCH_FOLDER, atch_name[0])
-        perm_path = os.path.join(PERM_FOLDER, atch_name[0])
+        atch_path = os.path.join(ATCH_FOLDER, atch_name)
+        perm_path = os.path.join(PERM_FOLDER, atch_name)
         try:
-            shutil.move(atch_path, perm_path)
+            os.replace(atch_path, perm_path)
         except Exception:
             logging.error(LOG_ERR[1])
             sys.exit(1)
@@ -198,7 +199,7 @@ def main():
     # second argument as the filename to use for this.
     perm_path = os.path.join(PERM_FOLDER, perm_name)
     try:
-        shutil.copy(RUN_NOW_FILE, perm_path)
+        shutil.copyfile(RUN_NOW_FILE, perm_path)
     except Exception:
         logging.error(LOG_ERR[2])
         sys.exit(1)
@@ -51,12 +51,12 @@ along with this program. If not, see <https://www.gnu.org/licenses/>.
 import sys
 import os
 import logging
-import dotenv  # Secrets and other configuration data
 
 from energenie import switch_on, switch_off
 
-# Get the working directory
-WORK_FOLDER = os.getcwd()
+# Get the working directory. This is the folder this program is in, so
+# it does not depend on where the program is started from.
+WORK_FOLDER = os.path.dirname(os.path.realpath(__file__))
 
 # Set the filename for the "logging" messages file
 LOG_FNAME = os.getenv('PI_SIGN_LOG', default='pi_signage.log')
@@ -100,12 +100,16 @@ def main():
     """
 
     # First initialise the logging feature
-    # Get the secrets values from the dotenv file
-    secrets = dotenv.dotenv_values(DOTENV_FILE)
-
-    # Set the logging level depending on the DEBUG value in th secrets file
+    # Get the DEBUG value from the environment, as exported by the calling
+    # script, or else from the dotenv file
+    debug_value = os.getenv('DEBUG')
+    if debug_value is None:
+        import dotenv  # The dotenv file is only read for a manual run
+        debug_value = dotenv.dotenv_values(DOTENV_FILE).get('DEBUG') or ''
+
+    # Set the logging level depending on the DEBUG value
     loglevel = getattr(logging, 'INFO', None)  # Default level is INFO
-    if secrets["DEBUG"].lower() == "true":
+    if debug_value.lower() == "true":
         loglevel = getattr(logging, 'DEBUG', None)  # Set level to DEBUG
 
     # Setup the logging facility with message format, filename and log level
@@ -121,9 +125,9 @@ def main():
 
     # Check that the first argument is numeric and that its value is from
     # zero to four.
-    if sys.argv[1].isnumeric():
+    if sys.argv[1].isdecimal():
         socketno = int(sys.argv[1])
-        if socketno not in range(5):
+        if not 0 <= socketno <= 4:
             logging.error(LOG_ERR[1])
             sys.exit(1)
     else: